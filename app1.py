@@ -1,17 +1,50 @@
 # app.py
+import base64
+import copy
+import functools
+import hashlib
+import hmac
+import json
 import os
-import random
-from datetime import datetime
-from flask import Flask, render_template, request, session, redirect, url_for, jsonify
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, as_completed, wait, TimeoutError as FuturesTimeoutError
+from urllib.request import urlopen
+from flask import Flask, Response, abort, g, render_template, request, session, redirect, url_for, jsonify, has_request_context, send_file, send_from_directory, stream_template, stream_with_context
+from flask import before_render_template, template_rendered
+from werkzeug.utils import secure_filename
 from flask_cors import CORS
-from openai import OpenAI
 import logging
 
+import config
+import metrics
+from export import FORMATS as EXPORT_FORMATS, Exporter
+from image_backends import open_image_backend
+from image_cache import ImageCache, cache_key, key_of
+from image_variants import VariantPipeline
+from stories import build_story, compile_all_templates, decode_story, placeholder_image_url, story_rng
+from story_store import MemoryStoryStore, new_story_id, open_story_store
+from idempotency import IdempotencyStore, KeyReused, request_fingerprint, scoped_key
+from jobs import JobQueue, QueueFull
+from profiling import RequestProfiler
+from scheduler import LatencyTracker, RateScheduler, error_status, hedge
+from singleflight import SingleFlight
+
 app = Flask(__name__, static_folder='static', template_folder='templates')
 app.secret_key = "dev-secret-key"  # Change for production!
 CORS(app, origins=["http://localhost:3000", "http://127.0.0.1:3000", "http://localhost:5000"])
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=config.LOG_LEVEL)
+
+# Profiles requests sent with an X-Profile header, and a sample of the rest
+request_profiler = RequestProfiler(
+    app.wsgi_app,
+    config.PROFILE_DIR,
+    token=config.ADMIN_TOKEN,
+    sample_rate=config.PROFILE_SAMPLE_RATE,
+    max_files=config.PROFILE_MAX_FILES
+)
+app.wsgi_app = request_profiler
 
 
 # Route to set the user's API key
@@ -23,316 +56,440 @@ def set_api_key():
     session["OPENAI_API_KEY"] = api_key
     return {"message": "API key saved successfully!"}, 200
 
-# Create a client for each request, using the user's key
-def get_client():
-    api_key = session.get("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("API key not set. Please provide your OpenAI API key.")
-    return OpenAI(api_key=api_key)
-
-# Story templates for different genres
-STORY_TEMPLATES = {
-    "fantasy": [
-        {
-            "title": "The Enchanted {item}",
-            "scenes": [
-                {
-                    "title": "The Discovery",
-                    "text": "In the heart of the {place}, {character} stumbled upon a mysterious {item} that seemed to glow with an otherworldly light. Little did {character} know, this was no ordinary {item} - it held the key to a hidden realm that had been forgotten for centuries.",
-                    "image_prompt": "{character} discovering a glowing {item} in a {place}, fantasy style"
-                },
-                {
-                    "title": "The Gateway",
-                    "text": "As {character} touched the {item}, a shimmering portal materialized before {character}. Through the swirling mist, {character} could see a world of {fantasy_elements}. With a deep breath, {character} stepped through, leaving the familiar world behind.",
-                    "image_prompt": "A magical portal opening in a {place} with {fantasy_elements} visible through it, fantasy art"
-                },
-                {
-                    "title": "The Challenge",
-                    "text": "In this new realm, {character} encountered a {magical_creature} who explained that the {item} was actually the {important_artifact} needed to {important_task}. But first, {character} had to prove worthy by {challenge_description}.",
-                    "image_prompt": "{character} facing a {magical_creature} in a magical realm, fantasy illustration"
-                },
-                {
-                    "title": "The Triumph",
-                    "text": "After successfully {challenge_completion}, {character} used the {item} to {successful_action}, restoring balance to the magical realm. The {magical_creature} granted {character} a gift - the ability to travel between worlds whenever needed.",
-                    "image_prompt": "{character} triumphantly holding the {item} with magical energy swirling around, epic fantasy art"
-                }
-            ]
-        }
-    ],
-    "sci-fi": [
-        {
-            "title": "The {tech_device} Incident",
-            "scenes": [
-                {
-                    "title": "The Anomaly",
-                    "text": "While conducting routine experiments with the {tech_device}, {character} noticed strange readings that defied all known physics. The device was detecting {sci_fi_phenomenon} from a distant sector of space - something that should be impossible according to current scientific understanding.",
-                    "image_prompt": "{character} observing strange readings on a {tech_device} display, sci-fi style"
-                },
-                {
-                    "title": "First Contact",
-                    "text": "Following the anomalous signals, {character} and the team embarked on a journey to the source. What they found was beyond anything they could have imagined - a {alien_species} whose technology operated on principles humanity had yet to discover.",
-                    "image_prompt": "First contact with a {alien_species} in a spaceship or alien environment, science fiction art"
-                },
-                {
-                    "title": "The Revelation",
-                    "text": "The {alien_species} revealed that the {tech_device} was actually a key to preventing an impending {cosmic_threat}. They needed humanity's help because only human DNA could interface with the ancient technology designed to {solution_action}.",
-                    "image_prompt": "{alien_species} explaining a {cosmic_threat} to {character} and team, sci-fi illustration"
-                },
-                {
-                    "title": "The Solution",
-                    "text": "Working together with the {alien_species}, {character} used the modified {tech_device} to {successful_solution}, averting disaster and opening a new chapter in human-alien relations. The experience changed humanity's understanding of its place in the universe forever.",
-                    "image_prompt": "{character} operating a advanced device with alien technology to save the day, epic sci-fi art"
-                }
-                    
-            ]
-        }
-    ],
-    "mystery": [
-        {
-            "title": "The Case of the {mysterious_object}",
-            "scenes": [
-                {
-                    "title": "The Discovery",
-                    "text": "When {character} found the {mysterious_object} in the {location}, little did {character} know it would lead to the unraveling of a decades-old mystery. The object contained clues that connected to the unsolved case of the {famous_mystery}.",
-                    "image_prompt": "{character} discovering a {mysterious_object} in a {location}, mysterious atmosphere"
-                },
-                {
-                    "title": "The Investigation",
-                    "text": "Following the clues from the {mysterious_object}, {character} began investigating the {historical_location} and uncovered evidence that suggested the original investigation had missed crucial details. Witness accounts from the time period didn't match the official story.",
-                    "image_prompt": "{character} investigating clues and examining evidence in a {historical_location}, noir style"
-                },
-                {
-                    "title": "The Breakthrough",
-                    "text": "A hidden message in the {mysterious_object} led {character} to a secret {hidden_place} where the truth had been concealed all along. There, {character} found proof that {shocking_revelation}.",
-                    "image_prompt": "{character} finding hidden evidence in a secret {hidden_place}, dramatic lighting"
-                },
-                {
-                    "title": "The Resolution",
-                    "text": "With the mystery finally solved, {character} was able to bring closure to those affected by the events. The {mysterious_object} was placed in a museum as a testament to the importance of perseverance in seeking truth.",
-                    "image_prompt": "{character} presenting the solved mystery and the {mysterious_object} in a museum or public setting, satisfying resolution"
-                }
-            ]
-        }
-    ]
-}
-
-# Word banks for different categories
-WORD_BANKS = {
-    "character": ["young girl", "curious boy", "brave explorer", "retired detective", "scientist", "student", "artist", "writer"],
-    "place": ["ancient forest", "abandoned factory", "grandmother's attic", "old library", "seaside cliff", "mountain cave", "city museum"],
-    "item": ["necklace", "book", "compass", "key", "crystal", "watch", "locket", "ring"],
-    "fantasy_elements": ["floating islands", "talking animals", "enchanted trees", "magical streams", "mythical creatures"],
-    "magical_creature": ["wise dragon", "ancient tree spirit", "mischievous fairy", "noble unicorn", "helpful gnome"],
-    "important_artifact": ["Heart of the Forest", "Star Crystal", "Moon Amulet", "Sun Stone", "Key of Ages"],
-    "important_task": ["restore the fading magic", "heal the wounded land", "awaken the sleeping guardians", "banish the spreading darkness"],
-    "challenge_description": ["retrieving the lost artifact from the treacherous mountains", "solving the riddles of the ancient temple", "earning the trust of the wary forest creatures"],
-    "challenge_completion": ["retrieving the artifact", "solving the riddles", "earning their trust"],
-    "successful_action": ["channel the ancient energies", "awaken the guardians", "heal the land"],
-    "tech_device": ["quantum resonator", "tachyon scanner", "dimensional gateway", "chronal stabilizer"],
-    "sci_fi_phenomenon": ["temporal distortions", "gravitational anomalies", "energy signatures", "dimensional rifts"],
-    "alien_species": ["crystalline beings", "energy-based lifeforms", "telepathic hive mind", "shape-shifting species"],
-    "cosmic_threat": ["dimensional collapse", "time paradox", "black hole emergence", "reality unraveling"],
-    "solution_action": ["stabilize the space-time continuum", "prevent the cosmic catastrophe", "seal the dimensional breach"],
-    "successful_solution": ["redirect the destructive energy", "stabilize the anomaly", "close the rift"],
-    "mysterious_object": ["old diary", "strange device", "cryptic painting", "ancient coin", "weathered photograph"],
-    "location": ["antique shop", "family estate", "old hotel", "university archive", "beach house"],
-    "famous_mystery": ["Vanishing Heiress", "Phantom Writer", "Silent Symphony", "Missing Inventor"],
-    "historical_location": ["old mansion", "abandoned hospital", "historic theater", "former factory"],
-    "hidden_place": ["secret room", "underground tunnel", "hidden compartment", "forgotten archive"],
-    "shocking_revelation": ["the supposed victim was actually the mastermind", "there were two identical objects switched at the critical moment", "the key witness had been misleading everyone intentionally"]
-}
-
-# Art style modifiers
-ART_STYLES = {
-    "realistic": "photorealistic, detailed, realistic",
-    "cartoon": "cartoon style, vibrant colors, animated",
-    "anime": "anime style, Japanese animation, vibrant",
-    "watercolor": "watercolor painting, soft edges, artistic",
-    "digital art": "digital art, concept art, dramatic lighting",
-    "oil painting": "oil painting, classic art, textured"
-}
-
-def generate_image_url(prompt, style):
+# Where scene images come from: OpenAI, stock placeholders or a local fake API
+image_backend = open_image_backend(
+    config.IMAGE_BACKEND,
+    model=config.IMAGE_MODEL,
+    size=config.IMAGE_WIDTH,
+    timeout=config.IMAGE_TIMEOUT,
+    client_pool_size=config.OPENAI_CLIENT_POOL_SIZE,
+    fake_options=config.FAKE_IMAGE_OPTIONS
+)
+
+def api_key_id(api_key):
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+# Every image API call goes through here: each API key gets its own rate
+# limit and concurrency window, and keys with work waiting take turns
+image_scheduler = RateScheduler(
+    max_workers=config.IMAGE_WORKERS,
+    rate=config.IMAGE_RATE_LIMIT / 60,
+    burst=config.IMAGE_RATE_BURST,
+    max_concurrency=config.IMAGE_WORKERS,
+    max_retries=config.IMAGE_MAX_RETRIES,
+    base_delay=config.IMAGE_RETRY_BASE_DELAY,
+    max_delay=config.IMAGE_RETRY_MAX_DELAY,
+    max_async=config.ASYNC_IMAGE_CALLS,
+    max_async_concurrency=config.ASYNC_IMAGE_CALLS
+)
+
+# Generated images are kept locally, so repeats skip the API and expired OpenAI URLs don't matter
+image_cache = ImageCache(
+    config.IMAGE_CACHE_DIR,
+    max_memory_entries=config.IMAGE_CACHE_MEMORY_ENTRIES,
+    max_disk_bytes=config.IMAGE_CACHE_DISK_BYTES,
+    ttl=config.IMAGE_CACHE_TTL
+)
+
+# Smaller WebP/AVIF copies of each stored image, made in worker processes off the request path
+image_variants = VariantPipeline(
+    config.IMAGE_CACHE_DIR,
+    widths=config.IMAGE_VARIANT_WIDTHS,
+    formats=config.IMAGE_VARIANT_FORMATS,
+    workers=config.IMAGE_VARIANT_WORKERS
+)
+image_cache.on_evict = image_variants.remove
+
+# Lets story.html offer browsers the smallest image that fits
+@app.template_global()
+def image_sources(url):
+    return image_variants.sources(url, config.IMAGE_WIDTH)
+
+# Read and decode downloads in pieces this big (a multiple of 4 for base64)
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+def image_chunks(image):
+    """Yield the bytes of a generated image piece by piece, whether inlined or behind a URL"""
+    if image.b64_json:
+        data = image.b64_json
+        for start in range(0, len(data), IMAGE_CHUNK_SIZE):
+            yield base64.b64decode(data[start:start + IMAGE_CHUNK_SIZE])
+        return
+    with urlopen(image.url, timeout=config.IMAGE_TIMEOUT) as response:
+        while True:
+            chunk = response.read(IMAGE_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+# Identical prompts requested at the same time share a single scheduled API call
+image_flights = SingleFlight()
+
+# How long recent image calls took, for deciding when to hedge
+image_latency = LatencyTracker()
+
+def record_image_call(started, error=None):
+    """Count a finished image backend call that started at ``started`` (time.monotonic())"""
+    elapsed = time.monotonic() - started
+    if error is None:
+        image_latency.record(elapsed)
+        outcome = "ok"
+    else:
+        status = error_status(error)
+        outcome = "throttled" if status == 429 else "error"
+        metrics.IMAGE_CALL_ERRORS.inc(status=status or "none")
+    metrics.IMAGE_CALL_SECONDS.observe(elapsed, outcome=outcome)
+    metrics.IMAGE_CALLS.inc(outcome=outcome)
+
+def create_image(key, prompt, style, api_key=None):
+    """Call the image backend for a prompt and cache the result"""
+    metrics.IMAGE_CALLS_IN_FLIGHT.inc()
+    started = time.monotonic()
+    try:
+        image = image_backend.generate(prompt, style, api_key)
+    except Exception as e:
+        record_image_call(started, e)
+        raise
+    finally:
+        metrics.IMAGE_CALLS_IN_FLIGHT.dec()
+    record_image_call(started)
+    return store_image(key, image)
+
+def store_image(key, image):
+    """Save a generated image to the cache and queue its variants; returns the URL to show"""
     try:
-        client = get_client()
-        response = client.images.generate(
-            model="gpt-image-1",
-            prompt=f"{prompt}, style {style}",
-            size="1024x1024"
-        )
-        url = response.data[0].url
-        print("Generated image URL:", url)  # <-- Add this line
+        url = image_cache.put_chunks(key, image_chunks(image))
+        image_variants.submit(url.rsplit("/", 1)[1])
         return url
+    except Exception as e:
+        # Still show the image this time, it just won't be cached
+        print("Image caching failed:", e)
+        return image.url
+
+def fetch_image(key, prompt, style, api_key=None):
+    # Another request may have made this image while we waited our turn;
+    # submit_image already counted this lookup
+    cached_url = image_cache.get(key, count=False)
+    if cached_url:
+        return cached_url
+    return create_image(key, prompt, style, api_key)
+
+def submit_image(prompt, style, api_key=None):
+    """Start generating an image and return a future for its URL; cached images are ready at once"""
+    key = cache_key(prompt, style, config.IMAGE_MODEL)
+    future = Future()
+    cached_url = image_backend.direct_url(prompt, style) or image_cache.get(key)
+    if cached_url:
+        future.set_result(cached_url)
+        return future
+    # Callers asking for an image already on its way share its call, before
+    # it is scheduled: waiting for it takes no thread, window slot or rate token
+    return image_flights.submit(key, functools.partial(schedule_image, key, prompt, style, api_key))
+
+def schedule_image(key, prompt, style, api_key=None):
+    """Queue the call for an image in the scheduler, hedged when IMAGE_HEDGE is on"""
+    deadline = time.monotonic() + config.IMAGE_TIMEOUT
+    future = image_scheduler.submit(api_key_id(api_key), fetch_image, key, prompt, style, api_key, deadline=deadline)
+    p95 = image_latency.percentile(0.95) if config.IMAGE_HEDGE else None
+    if p95 is None:
+        return future
+    # The backup still waits its turn in the scheduler, so hedging can't flood the API
+    backup = functools.partial(image_scheduler.submit, api_key_id(api_key), create_image, key, prompt, style, api_key, deadline=deadline)
+    return hedge(future, backup, p95)
+
+def generate_image_url(prompt, style, api_key=None):
+    try:
+        return submit_image(prompt, style, api_key).result()
     except Exception as e:
         print("Image generation failed:", e)
         return None  # No placeholder, just None
 
-def generate_story(idea, genre, tone, audience, art_style):
-    # Select appropriate template based on genre
-    if genre not in STORY_TEMPLATES:
-        genre = "fantasy"
-    template = random.choice(STORY_TEMPLATES[genre])
-
-    # Extract keywords from the idea
-    keywords = extract_keywords(idea)
-
-    # Fill in the template with appropriate words
-    story = {
-        "title": fill_template(template["title"], keywords, genre, tone, audience),
-        "scenes": [],
-        "idea": idea,
-        "art_style": art_style,
-        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-
-    for scene_template in template["scenes"]:
-        filled_scene = {
-            "title": fill_template(scene_template["title"], keywords, genre, tone, audience),
-            "text": fill_template(scene_template["text"], keywords, genre, tone, audience),
-            "image_prompt": fill_template(scene_template["image_prompt"], keywords, genre, tone, audience)
-        }
-        # Use the actual scene text for image generation
-        image_url = generate_image_url(filled_scene["text"], art_style)
+def iter_scene_images(prompts, art_style, api_key=None, timeout=None, late=None):
+    """Generate one image per prompt concurrently, yielding (index, url) as each finishes.
+
+    Scenes not done within ``timeout`` seconds (IMAGE_TIMEOUT by default)
+    yield None and their calls are cancelled, unless ``late`` is given: it is
+    then called with {future: index} for those scenes and they carry on.
+    """
+    futures = {submit_image(prompt, art_style, api_key): index for index, prompt in enumerate(prompts)}
+    try:
+        for future in as_completed(futures, timeout=timeout or config.IMAGE_TIMEOUT):
+            index = futures.pop(future)
+            try:
+                image_url = future.result()
+            except Exception as e:
+                # A failed scene just goes without an image
+                print("Image generation failed:", e)
+                image_url = None
+            yield index, image_url
+    except FuturesTimeoutError:
+        # Scenes still running at the deadline go without an image too;
+        # the ones that haven't started yet are dropped from the queue
+        if late is not None:
+            late(futures)
+        else:
+            for future in futures:
+                future.cancel()
+        for index in sorted(futures.values()):
+            yield index, None
+
+def generate_scene_images(prompts, art_style, api_key=None):
+    """Generate one image per prompt concurrently, keeping the prompt order"""
+    image_urls = [None] * len(prompts)
+    for index, image_url in iter_scene_images(prompts, art_style, api_key):
+        image_urls[index] = image_url
+    return image_urls
+
+def request_api_key(api_key=None):
+    # The session is only readable on the request thread, so resolve the key there
+    if api_key is None and has_request_context():
+        api_key = session.get("OPENAI_API_KEY")
+    return api_key
+
+# Stories are saved from request threads and from late image callbacks
+story_save_lock = threading.Lock()
+
+def save_story(story_id, story):
+    with story_save_lock:
+        story_store.put(story_id, story)
+
+def fill_late_image(story_id, story, index, future):
+    """Swap a late scene's placeholder for its real image once the call finishes"""
+    image_url = None
+    if not future.cancelled():
+        if future.exception() is not None:
+            print("Image generation failed:", future.exception())
+        else:
+            image_url = future.result()
+    scene = story["scenes"][index]
+    with story_save_lock:
+        if image_url:
+            scene["image_url"] = image_url
+        scene["image_pending"] = False
+        if story_id:
+            story_store.put(story_id, story)
+
+_IMAGES_SECONDS = metrics.STAGE_SECONDS.labels(stage="images")
+
+def iter_story_images(story, api_key=None, story_id=None, deadline=None):
+    """Generate the images for a built story, setting each scene's image_url as it finishes.
+
+    Scenes not done within IMAGE_TIMEOUT go without an image. With a
+    ``deadline`` in seconds, scenes still waiting then get a placeholder
+    (marked ``image_pending``) instead, so the story isn't held up; their
+    real images replace it once they are ready, in the story store too when
+    ``story_id`` is given.
+    """
+    def late(futures):
+        for future, index in futures.items():
+            scene = story["scenes"][index]
+            scene["image_url"] = placeholder_image_url(scene["image_prompt"], story["art_style"])
+            scene["image_pending"] = True
+            future.add_done_callback(functools.partial(fill_late_image, story_id, story, index))
+
+    # Use the actual scene text for image generation (stock pictures go by the image prompt)
+    prompts = [image_backend.scene_prompt(scene) for scene in story["scenes"]]
+    started = time.perf_counter()
+    for index, image_url in iter_scene_images(prompts, story["art_style"], request_api_key(api_key), deadline, late if deadline else None):
         if image_url:
-            filled_scene["image_url"] = image_url
-        story["scenes"].append(filled_scene)
+            story["scenes"][index]["image_url"] = image_url
+        yield index, story["scenes"][index].get("image_url")
+    _IMAGES_SECONDS.observe(time.perf_counter() - started)
+
+# Seeded stories are reproducible, so whole stories (images included) can be reused
+story_cache = MemoryStoryStore(max_entries=config.STORY_CACHE_ENTRIES, ttl=config.STORY_CACHE_TTL)
 
+def cached_story(cache_id):
+    """A copy of a story from story_cache, or None"""
+    story = story_cache.get(cache_id)
+    metrics.STORY_CACHE_LOOKUPS.inc(result="hit" if story else "miss")
+    return copy.deepcopy(story) if story else None
+
+def cache_story(cache_id, story):
+    # Only keep complete stories, so a missing image is tried again next time
+    if all(scene.get("image_url") and not scene.get("image_pending") for scene in story["scenes"]):
+        story_cache.put(cache_id, copy.deepcopy(story))
+
+def generate_story(idea, genre, tone, audience, art_style, api_key=None, seed=None):
+    cache_id = json.dumps([idea, genre, tone, audience, art_style, seed]) if seed is not None else None
+    if cache_id:
+        story = cached_story(cache_id)
+        if story:
+            return story
+    story = build_story(idea, genre, tone, audience, art_style, story_rng(seed))
+    for _ in iter_story_images(story, api_key):
+        pass
+    if cache_id:
+        cache_story(cache_id, story)
     return story
 
+def generate_batch(items, api_key=None, max_in_flight=None):
+    """Generate many stories, yielding (index, story) as each one finishes.
 
-def extract_keywords(idea):
-    """Extract potential keywords from the story idea"""
-    keywords = {
-        "character": random.choice(WORD_BANKS["character"]),
-        "item": random.choice(WORD_BANKS["item"]),
-        "place": random.choice(WORD_BANKS["place"])
-    }
-    # Try to extract a character from the idea
-    if "girl" in idea.lower():
-        keywords["character"] = "young girl"
-    elif "boy" in idea.lower():
-        keywords["character"] = "curious boy"
-    elif "man" in idea.lower():
-        keywords["character"] = "old man"
-    elif "woman" in idea.lower():
-        keywords["character"] = "wise woman"
-    elif "robot" in idea.lower():
-        keywords["character"] = "lonely robot"
-    elif "detective" in idea.lower():
-        keywords["character"] = "retired detective"
-    # Try to extract an item from the idea
-    for item in WORD_BANKS["item"]:
-        if item in idea.lower():
-            keywords["item"] = item
-            break
-    # Try to extract a place from the idea
-    for place in WORD_BANKS["place"]:
-        if place in idea.lower():
-            keywords["place"] = place
-            break
-    return keywords
-
-def fill_template(template, keywords, genre, tone, audience):
-    """Fill in a template with appropriate words"""
-    result = template
-    # Replace known keywords
-    for key, value in keywords.items():
-        result = result.replace("{" + key + "}", value)
-    # Replace other placeholders with appropriate words from the word bank
-    while "{" in result and "}" in result:
-        start = result.find("{")
-        end = result.find("}")
-        if start != -1 and end != -1:
-            placeholder = result[start+1:end]
-            if placeholder in WORD_BANKS:
-                replacement = random.choice(WORD_BANKS[placeholder])
-                result = result.replace("{" + placeholder + "}", replacement)
-            else:
-                # If we don't have this placeholder, just remove it
-                result = result.replace("{" + placeholder + "}", "")
-    # Adjust tone based on the selected tone
-    if tone == "dark":
-        result = make_darker(result)
-    elif tone == "humorous":
-        result = make_funnier(result)
-    elif tone == "epic":
-        result = make_epic(result)
-    elif tone == "mysterious":
-        result = make_mysterious(result)
-    # Adjust for audience
-    if audience == "kids":
-        result = simplify_language(result)
-    return result
-
-def make_darker(text):
-    """Make the text darker in tone"""
-    dark_words = ["sinister", "foreboding", "ominous", "shadowy", "eerie", "chilling"]
-    replacements = {
-        "mysterious": random.choice(dark_words),
-        "strange": "ominous",
-        "interesting": "disturbing",
-        "beautiful": "macabre"
-    }
-    for original, replacement in replacements.items():
-        text = text.replace(original, replacement)
-    return text
-
-def make_funnier(text):
-    """Make the text more humorous"""
-    funny_words = ["hilarious", "comical", "absurd", "ridiculous", "ludicrous"]
-    replacements = {
-        "strange": random.choice(funny_words),
-        "interesting": "hilarious",
-        "mysterious": "absurd",
-        "serious": "comical"
-    }
-    for original, replacement in replacements.items():
-        text = text.replace(original, replacement)
-    return text
-
-def make_epic(text):
-    """Make the text more epic"""
-    epic_words = ["legendary", "monumental", "colossal", "astounding", "breathtaking"]
-    replacements = {
-        "great": random.choice(epic_words),
-        "big": "colossal",
-        "important": "monumental",
-        "interesting": "astounding"
-    }
-    for original, replacement in replacements.items():
-        text = text.replace(original, replacement)
-    return text
-
-def make_mysterious(text):
-    """Make the text more mysterious"""
-    mystery_words = ["enigmatic", "cryptic", "perplexing", "inscrutable", "puzzling"]
-    replacements = {
-        "mysterious": random.choice(mystery_words),
-        "strange": "enigmatic",
-        "interesting": "perplexing",
-        "secret": "inscrutable"
-    }
-    for original, replacement in replacements.items():
-        text = text.replace(original, replacement)
-    return text
-
-def simplify_language(text):
-    """Simplify language for children"""
-    replacements = {
-        "discovered": "found",
-        "encountered": "met",
-        "investigating": "looking into",
-        "ancient": "very old",
-        "mysterious": "strange",
-        "artifact": "special object",
-        "revelation": "big surprise",
-        "resolution": "ending",
-        "challenge": "test",
-        "triumph": "happy ending"
-    }
-    for complex_word, simple_word in replacements.items():
-        text = text.replace(complex_word, simple_word)
-    return text
+    ``items`` is any iterable of story option dicts and is only read as
+    there is room for more work, so huge batches are never held in memory.
+    All scene images share one limit of ``max_in_flight`` API calls, and a
+    prompt repeated within the batch is only generated once.
+    """
+    max_in_flight = max_in_flight or config.BATCH_MAX_IN_FLIGHT
+    items = enumerate(items)
+    waiting = {}  # image future -> [(story state, scene index), ...]
+    by_key = {}  # image cache key -> future, while it is in flight
+    keys = {}  # image future -> image cache key
+    exhausted = False
+
+    while not exhausted or waiting:
+        # Start stories until the shared image limit is reached
+        while not exhausted and len(waiting) < max_in_flight:
+            try:
+                index, item = next(items)
+            except StopIteration:
+                exhausted = True
+                break
+            if not isinstance(item, dict):
+                yield index, {"error": "Each story must be a JSON object"}
+                continue
+            try:
+                rng = story_rng(story_seed(item))
+            except ValueError as e:
+                yield index, {"error": str(e)}
+                continue
+            params = story_params(item)
+            if not all(isinstance(value, str) for value in params):
+                yield index, {"error": "Story options must be strings"}
+                continue
+            story = build_story(*params, rng)
+            state = {"index": index, "story": story, "remaining": len(story["scenes"])}
+            if not story["scenes"]:
+                yield index, story
+            for scene_index, scene in enumerate(story["scenes"]):
+                prompt = image_backend.scene_prompt(scene)
+                key = cache_key(prompt, story["art_style"], config.IMAGE_MODEL)
+                future = by_key.get(key)
+                if future is None:
+                    future = submit_image(prompt, story["art_style"], api_key)
+                    by_key[key] = future
+                    keys[future] = key
+                    waiting[future] = []
+                waiting[future].append((state, scene_index))
+
+        if not waiting:
+            continue
+        done, _ = wait(list(waiting), return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                image_url = future.result()
+            except Exception as e:
+                print("Image generation failed:", e)
+                image_url = None
+            # Later repeats of this prompt are served by the image cache
+            del by_key[keys.pop(future)]
+            for state, scene_index in waiting.pop(future):
+                if image_url:
+                    state["story"]["scenes"][scene_index]["image_url"] = image_url
+                state["remaining"] -= 1
+                if state["remaining"] == 0:
+                    yield state["index"], state["story"]
+
+# Stories are kept on the server; the session cookie only carries the story id
+story_store = open_story_store(config.STORY_STORE, max_entries=config.STORY_STORE_MAX_ENTRIES, ttl=config.STORY_TTL)
+
+# Results of /api/generate requests sent with an Idempotency-Key, so a retry
+# gets the first attempt's story instead of paying for its images again
+idempotent_requests = IdempotencyStore(max_entries=config.IDEMPOTENCY_MAX_ENTRIES, ttl=config.IDEMPOTENCY_TTL)
+
+# Background story generation for clients that poll instead of waiting
+story_jobs = JobQueue(max_workers=config.JOB_WORKERS, max_pending=config.JOB_MAX_PENDING, ttl=config.JOB_TTL)
+
+def story_params(data):
+    """Read the story options from a JSON request body"""
+    return (
+        data.get('story_idea', 'A mysterious story'),
+        data.get('genre', 'fantasy'),
+        data.get('tone', 'lighthearted'),
+        data.get('audience', 'teens'),
+        data.get('art_style', 'realistic')
+    )
+
+def story_seed(data):
+    """Read the optional seed from a JSON request body; a seed makes the story reproducible"""
+    seed = data.get('seed')
+    if seed is None:
+        return None
+    # bool is an int subclass, but true isn't a seed
+    if isinstance(seed, bool) or not isinstance(seed, int):
+        raise ValueError("seed must be an integer")
+    return seed
+
+# Readings taken from the image machinery when /metrics is scraped
+metrics.GaugeFunction(
+    "image_cache_lookups_total", "Image cache lookups (hit, miss)",
+    lambda: {"hit": image_cache.stats["memory_hits"] + image_cache.stats["disk_hits"], "miss": image_cache.stats["misses"]},
+    labelnames=["result"], kind="counter"
+)
+metrics.GaugeFunction("image_call_retries_total", "Image calls retried after a 429 or 5xx", lambda: image_scheduler.retries, kind="counter")
+metrics.GaugeFunction("image_calls_queued", "Image calls waiting for their turn in the scheduler", lambda: sum(tenant["queued"] for tenant in image_scheduler.stats().values()))
+metrics.GaugeFunction("image_flights_in_progress", "Distinct images queued or being generated right now", image_flights.in_flight)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or "none", status=response.status_code)
+    return response
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def record_render_time(sender, template, context, **extra):
+    started = g.pop("render_started", None)
+    if started is not None:
+        metrics.TEMPLATE_RENDER_SECONDS.observe(time.perf_counter() - started, template=template.name)
+
+@app.route('/metrics')
+def metrics_route():
+    """Counters and histograms in the Prometheus text format"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def require_admin():
+    """Stop the request unless it carries the admin token"""
+    if not config.ADMIN_TOKEN:
+        abort(404)
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    # compare_digest only takes ASCII str, so compare bytes
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode("utf-8"), config.ADMIN_TOKEN.encode("utf-8")):
+        abort(403)
+
+@app.route('/admin/profiles')
+def admin_profiles():
+    """The most recent request profiles, newest first"""
+    require_admin()
+    return jsonify({"sample_rate": request_profiler.sample_rate, "profiles": request_profiler.recent()})
+
+@app.route('/admin/profiles/<name>')
+def admin_profile(name):
+    """Download a profile for pstats or snakeviz, or read it as text (?format=text&sort=tottime)"""
+    require_admin()
+    path = request_profiler.path(name)
+    if not path:
+        abort(404)
+    if request.args.get("format") == "text":
+        try:
+            summary = request_profiler.summary(name, sort=request.args.get("sort", "cumulative"), limit=request.args.get("limit", 40, type=int))
+        except KeyError:
+            abort(400)
+        return Response(summary, content_type="text/plain; charset=utf-8")
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True, download_name=name)
+
+@app.route('/favicon.ico')
+def favicon():
+    return '', 204
 
 @app.route('/')
 def index():
@@ -346,38 +503,223 @@ def generate_story_route():
         tone = request.form.get("tone", "lighthearted")
         audience = request.form.get("audience", "teens")
         art_style = request.form.get("art_style", "realistic")
-        story = generate_story(story_idea, genre, tone, audience, art_style)
-        return render_template("story.html", story=story)
+        story = build_story(story_idea, genre, tone, audience, art_style)
+        story_id = new_story_id()
+        story_store.put(story_id, story)
+        session['story_id'] = story_id
+        api_key = request_api_key()
+
+        # Send the text right away; the page fills in each image as it finishes
+        def image_updates():
+            # Only this page gives up on slow images, so the story shows up quickly
+            for index, image_url in iter_story_images(story, api_key, story_id, config.STORY_DEADLINE):
+                yield {"scene": index, "image_url": image_url}
+            # Save the story again now that it has its images
+            save_story(story_id, story)
+
+        return stream_template("story.html", story=story, image_updates=image_updates())
     except RuntimeError as e:
         # Show a user-friendly error if API key is missing
         return render_template("index.html", error=str(e))
 
 @app.route('/story')
 def view_story():
-    story = session.get('generated_story')
+    story_id = session.get('story_id')
+    story = story_store.get(story_id) if story_id else None
     if not story:
         # No story generated yet, redirect to home
         return redirect(url_for('index'))
     return render_template('story.html', story=story)
 
+@app.route('/story/<token>')
+def view_shared_story(token):
+    """Show a story rebuilt from its token, with whatever images are cached for it"""
+    try:
+        story = decode_story(token)
+    except ValueError:
+        return redirect(url_for('index'))
+    for scene in story["scenes"]:
+        prompt = image_backend.scene_prompt(scene)
+        image_url = image_backend.direct_url(prompt, story["art_style"]) or image_cache.get(cache_key(prompt, story["art_style"], config.IMAGE_MODEL))
+        if image_url:
+            scene["image_url"] = image_url
+    return render_template('story.html', story=story)
+
+@app.route('/images/<path:filename>')
+def cached_image(filename):
+    if filename.startswith("variants/") and not os.path.isfile(os.path.join(image_cache.directory, filename)):
+        # The variant isn't made yet; send the full-size image, but only briefly cached
+        original_url = image_cache.get(key_of(filename[len("variants/"):]))
+        if not original_url:
+            abort(404)
+        return send_from_directory(image_cache.directory, original_url.rsplit("/", 1)[1], max_age=60)
+    # Files are named after a hash of their content, which never changes for
+    # a name, so browsers and proxies may keep them for a long time; conditional requests and byte ranges are
+    # answered from the file without reading it into memory
+    response = send_from_directory(image_cache.directory, filename, conditional=True, etag=True, max_age=config.IMAGE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def stored_image_path(url):
+    """The local file behind an /images/ URL, or None"""
+    if not url or not url.startswith("/images/"):
+        return None
+    path = os.path.join(image_cache.directory, url.rsplit("/", 1)[1])
+    return path if os.path.isfile(path) else None
+
+story_exporter = Exporter(
+    config.EXPORT_CACHE_DIR,
+    stored_image_path,
+    workers=config.EXPORT_WORKERS,
+    max_files=config.EXPORT_CACHE_MAX_FILES
+)
+
 @app.route('/download-pdf')
 def download_pdf():
-    # Placeholder: implement PDF download if needed
-    return redirect(url_for('view_story'))
+    """Download the current story, or several (?story=<id>&story=<id>), as a PDF or an EPUB (?format=epub)"""
+    fmt = request.args.get("format", "pdf")
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+    story_ids = request.args.getlist("story") or [session.get("story_id")]
+    stories = [story_store.get(story_id) for story_id in story_ids if story_id]
+    if not stories or None in stories:
+        return redirect(url_for('view_story'))
+    download_name = f"{(secure_filename(stories[0]['title']) or 'story') if len(stories) == 1 else 'stories'}.{fmt}"
+
+    path = story_exporter.cached_path(story_ids, stories, fmt)
+    if path:
+        return send_file(path, mimetype=EXPORT_FORMATS[fmt], as_attachment=True, download_name=download_name, conditional=True)
+    # Send the file as it is written rather than laying out every scene first
+    return Response(
+        stream_with_context(story_exporter.stream(story_ids, stories, fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{download_name}"'}
+    )
+
+def generate_response(data, api_key=None):
+    """The (body, status) of /api/generate for a JSON request body"""
+    try:
+        return generate_story(*story_params(data), api_key=api_key, seed=story_seed(data)), 200
+    except (RuntimeError, ValueError) as e:
+        return {"error": str(e)}, 400
 
 @app.route('/api/generate', methods=['POST'])
 def api_generate():
+    """Generate a story; a retry with the same Idempotency-Key header gets the first attempt's result"""
+    # The placeholder app (open.py) read any body as JSON, whatever its Content-Type
+    data = request.get_json(force=image_backend.name == "placeholder")
+    api_key = request_api_key()
+    if "Idempotency-Key" not in request.headers:
+        body, status = generate_response(data, api_key)
+        return jsonify(body), status
     try:
-        data = request.get_json()
-        story_idea = data.get('story_idea', 'A mysterious story')
-        genre = data.get('genre', 'fantasy')
-        tone = data.get('tone', 'lighthearted')
-        audience = data.get('audience', 'teens')
-        art_style = data.get('art_style', 'realistic')
-        story = generate_story(story_idea, genre, tone, audience, art_style)
-        return jsonify(story)
-    except RuntimeError as e:
+        key = scoped_key(request.headers["Idempotency-Key"], api_key_id(api_key))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        (body, status), replayed = idempotent_requests.run(key, request_fingerprint(data), generate_response, data, api_key)
+    except KeyReused as e:
+        return jsonify({"error": str(e)}), 422
+    response = jsonify(body)
+    response.status_code = status
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+@app.route('/api/generate/stream', methods=['POST'])
+def api_generate_stream():
+    """Stream a story as newline-delimited JSON: the text first, then each image as it finishes"""
+    data = request.get_json()
+    try:
+        rng = story_rng(story_seed(data))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    story = build_story(*story_params(data), rng)
+    api_key = request_api_key()
+
+    def events():
+        yield json.dumps({"type": "story", "story": story}) + "\n"
+        for index, image_url in iter_story_images(story, api_key):
+            yield json.dumps({"type": "image", "scene": index, "image_url": image_url}) + "\n"
+        yield json.dumps({"type": "done"}) + "\n"
+
+    return Response(stream_with_context(events()), mimetype="application/x-ndjson")
+
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    """Generate a batch of stories, streaming each one as newline-delimited JSON when it is done.
+
+    The body is either a JSON list of story options or, for large batches,
+    newline-delimited JSON with one story's options per line.
+    """
+    if request.mimetype == "application/x-ndjson":
+        # Read the ideas line by line as the batch makes progress
+        def read_lines():
+            for line in request.stream:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        yield None
+        items = read_lines()
+    else:
+        items = request.get_json()
+        if not isinstance(items, list):
+            return jsonify({"error": "Expected a list of stories"}), 400
+    api_key = request_api_key()
+
+    def results():
+        count = 0
+        for index, story in generate_batch(items, api_key):
+            count += 1
+            if "error" in story:
+                yield json.dumps({"type": "error", "index": index, "error": story["error"]}) + "\n"
+            else:
+                yield json.dumps({"type": "story", "index": index, "story": story}) + "\n"
+        yield json.dumps({"type": "done", "count": count}) + "\n"
+
+    return Response(stream_with_context(results()), mimetype="application/x-ndjson")
+
+@app.route('/api/jobs', methods=['POST'])
+def api_create_job():
+    """Queue a story for background generation and return its job id right away"""
+    data = request.get_json()
+    try:
+        seed = story_seed(data)
+    except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    try:
+        job_id = story_jobs.submit(generate_story, *story_params(data), api_key=request_api_key(), seed=seed)
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({"job_id": job_id, "status_url": url_for('api_job_status', job_id=job_id)}), 202
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    job = story_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    response = {"job_id": job_id, "status": job["status"]}
+    if job["status"] == "done":
+        response["story"] = job["result"]
+    elif job["status"] == "failed":
+        response["error"] = job["error"]
+    return jsonify(response)
+
+def create_app():
+    """The app, with everything requests would otherwise build on first use made now.
+
+    Story templates, tone transforms, the keyword index and the page
+    templates are compiled here. Under a server that loads the app before
+    forking its workers (see wsgi.py) that happens once, and the workers share
+    the result. Thread pools, API clients and database connections are still
+    made in each worker, when first needed.
+    """
+    compile_all_templates()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    return app
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
+    create_app().run(debug=True, port=5001)
@@ -0,0 +1,244 @@
+# asgi.py
+"""The story app on asyncio, so many stories can be in flight in one process.
+
+    hypercorn asgi:app        (or any ASGI server, e.g. uvicorn asgi:app)
+
+/generate, /api/generate and /story are served by Quart. Their image calls
+are awaited on the event loop, with the async OpenAI client for the openai
+backend, instead of each holding a thread. Every other route is the sync
+app from app1.py, run in a thread pool, so both share the caches, stories,
+image scheduler, metrics and session cookie. Needs Quart (pip install
+quart); the sync app doesn't.
+"""
+import asyncio
+import functools
+import json
+import time
+
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from quart import Quart, g, jsonify, redirect, render_template, request, session, stream_template, url_for
+from werkzeug.routing import Rule
+
+import app1
+import config
+import metrics
+from idempotency import KeyReused, request_fingerprint, scoped_key
+from image_cache import cache_key
+from stories import build_story, placeholder_image_url, story_rng
+from story_store import new_story_id
+
+quart_app = Quart(__name__, static_folder='static', template_folder='templates')
+quart_app.secret_key = app1.app.secret_key  # Sessions are shared with the sync app
+quart_app.add_template_global(app1.image_sources, "image_sources")
+
+# Paths served here; the sync app serves the rest
+ASYNC_PATHS = {"/generate", "/api/generate", "/story"}
+
+async def create_image(key, prompt, style, api_key=None):
+    """app1.create_image, awaiting the image backend"""
+    metrics.IMAGE_CALLS_IN_FLIGHT.inc()
+    started = time.monotonic()
+    try:
+        image = await app1.image_backend.generate_async(prompt, style, api_key)
+    except Exception as e:
+        app1.record_image_call(started, e)
+        raise
+    finally:
+        metrics.IMAGE_CALLS_IN_FLIGHT.dec()
+    app1.record_image_call(started)
+    # Decoding and writing the file would hold up the loop
+    return await asyncio.to_thread(app1.store_image, key, image)
+
+async def fetch_image(key, prompt, style, api_key=None):
+    # Another request may have made this image while we waited our turn;
+    # submit_image already counted this lookup
+    cached_url = app1.image_cache.get(key, count=False)
+    if cached_url:
+        return cached_url
+    return await create_image(key, prompt, style, api_key)
+
+def submit_image(prompt, style, api_key=None):
+    """Start generating an image and return an asyncio future for its URL; cached images are ready at once"""
+    key = cache_key(prompt, style, config.IMAGE_MODEL)
+    cached_url = app1.image_backend.direct_url(prompt, style) or app1.image_cache.get(key)
+    if cached_url:
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(cached_url)
+        return future
+    # The same calls in flight and scheduler as the sync app, so the two
+    # share identical prompts and each key's limits
+    return asyncio.wrap_future(app1.image_flights.submit(key, functools.partial(schedule_image, key, prompt, style, api_key)))
+
+def schedule_image(key, prompt, style, api_key=None):
+    deadline = time.monotonic() + config.IMAGE_TIMEOUT
+    return app1.image_scheduler.submit(app1.api_key_id(api_key), fetch_image, key, prompt, style, api_key, deadline=deadline)
+
+def fill_late_image(story_id, story, index, future):
+    # app1.fill_late_image saves the story, which may block, so run it off the loop
+    asyncio.get_running_loop().run_in_executor(None, app1.fill_late_image, story_id, story, index, future)
+
+async def iter_story_images(story, api_key=None, story_id=None, deadline=None):
+    """app1.iter_story_images as an async generator"""
+    loop = asyncio.get_running_loop()
+    futures = {submit_image(app1.image_backend.scene_prompt(scene), story["art_style"], api_key): index for index, scene in enumerate(story["scenes"])}
+    pending = set(futures)
+    started = time.perf_counter()
+    give_up_at = loop.time() + (deadline or config.IMAGE_TIMEOUT)
+    while pending:
+        done, pending = await asyncio.wait(pending, timeout=give_up_at - loop.time(), return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            index = futures[future]
+            try:
+                image_url = future.result()
+            except Exception as e:
+                # A failed scene just goes without an image
+                print("Image generation failed:", e)
+                image_url = None
+            if image_url:
+                story["scenes"][index]["image_url"] = image_url
+            yield index, story["scenes"][index].get("image_url")
+
+    for future in pending:
+        index = futures[future]
+        scene = story["scenes"][index]
+        if deadline:
+            # Scenes still waiting at the deadline get a placeholder until their image is ready
+            scene["image_url"] = placeholder_image_url(scene["image_prompt"], story["art_style"])
+            scene["image_pending"] = True
+            future.add_done_callback(functools.partial(fill_late_image, story_id, story, index))
+        else:
+            future.cancel()
+    for index in sorted(futures[future] for future in pending):
+        yield index, story["scenes"][index].get("image_url")
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="images")
+
+async def generate_story(idea, genre, tone, audience, art_style, api_key=None, seed=None):
+    """app1.generate_story on the event loop"""
+    cache_id = json.dumps([idea, genre, tone, audience, art_style, seed]) if seed is not None else None
+    if cache_id:
+        story = app1.cached_story(cache_id)
+        if story:
+            return story
+    story = build_story(idea, genre, tone, audience, art_style, story_rng(seed))
+    async for _ in iter_story_images(story, api_key):
+        pass
+    if cache_id:
+        app1.cache_story(cache_id, story)
+    return story
+
+@quart_app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@quart_app.after_request
+async def record_request_time(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or "none", status=response.status_code)
+    return response
+
+@quart_app.route('/generate', methods=['POST'])
+async def generate_story_route():
+    try:
+        form = await request.form
+        story_idea = form.get("story_idea", "")
+        genre = form.get("genre", "fantasy")
+        tone = form.get("tone", "lighthearted")
+        audience = form.get("audience", "teens")
+        art_style = form.get("art_style", "realistic")
+        story = build_story(story_idea, genre, tone, audience, art_style)
+        story_id = new_story_id()
+        await asyncio.to_thread(app1.save_story, story_id, story)
+        session['story_id'] = story_id
+        api_key = session.get("OPENAI_API_KEY")
+
+        # Send the text right away; the page fills in each image as it finishes
+        async def image_updates():
+            async for index, image_url in iter_story_images(story, api_key, story_id, config.STORY_DEADLINE):
+                yield {"scene": index, "image_url": image_url}
+            # Save the story again now that it has its images
+            await asyncio.to_thread(app1.save_story, story_id, story)
+
+        return await stream_template("story.html", story=story, image_updates=image_updates())
+    except RuntimeError as e:
+        # Show a user-friendly error if API key is missing
+        return await render_template("index.html", error=str(e))
+
+@quart_app.route('/story')
+async def view_story():
+    story_id = session.get('story_id')
+    story = await asyncio.to_thread(app1.story_store.get, story_id) if story_id else None
+    if not story:
+        # No story generated yet, redirect to home
+        return redirect(url_for('index'))
+    return await render_template('story.html', story=story)
+
+async def generate_response(data, api_key=None):
+    """app1.generate_response on the event loop"""
+    try:
+        return await generate_story(*app1.story_params(data), api_key=api_key, seed=app1.story_seed(data)), 200
+    except (RuntimeError, ValueError) as e:
+        return {"error": str(e)}, 400
+
+# Requests carried on after their client left, so retries can still get their result
+background_requests = set()
+
+def settle_request(key, future, task):
+    background_requests.discard(task)
+    if task.cancelled():
+        app1.idempotent_requests.fail(key, future, asyncio.CancelledError())
+    elif task.exception() is not None:
+        app1.idempotent_requests.fail(key, future, task.exception())
+    else:
+        app1.idempotent_requests.finish(key, future, task.result())
+
+@quart_app.route('/api/generate', methods=['POST'])
+async def api_generate():
+    """Generate a story; a retry with the same Idempotency-Key header gets the first attempt's result"""
+    data = await request.get_json(force=app1.image_backend.name == "placeholder")
+    api_key = session.get("OPENAI_API_KEY")
+    if "Idempotency-Key" not in request.headers:
+        body, status = await generate_response(data, api_key)
+        return jsonify(body), status
+    try:
+        key = scoped_key(request.headers["Idempotency-Key"], app1.api_key_id(api_key))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        future, leader = app1.idempotent_requests.claim(key, request_fingerprint(data))
+    except KeyReused as e:
+        return jsonify({"error": str(e)}), 422
+    if leader:
+        # Not tied to this request: the server cancels a request whose client
+        # disconnects, and that client's retry should find the story, not start over
+        task = asyncio.ensure_future(generate_response(data, api_key))
+        background_requests.add(task)
+        task.add_done_callback(functools.partial(settle_request, key, future))
+    body, status = await asyncio.shield(asyncio.wrap_future(future))
+    response = jsonify(body)
+    response.status_code = status
+    if not leader:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+# The pages use url_for to link to routes the sync app serves
+for rule in app1.app.url_map.iter_rules():
+    if rule.endpoint not in quart_app.view_functions:
+        quart_app.url_map.add(Rule(rule.rule, endpoint=rule.endpoint, methods=rule.methods, build_only=True))
+
+# Runs in the loop's thread pool. Request bodies are read in full first, so
+# leave room for big /api/batch requests
+sync_app = AsyncioWSGIMiddleware(app1.app, max_body_size=16 * 1024 * 1024)
+
+async def app(scope, receive, send):
+    """The ASGI app: the async routes, and the sync app for everything else"""
+    if scope["type"] == "http" and scope["path"] not in ASYNC_PATHS:
+        await sync_app(scope, receive, send)
+    else:
+        await quart_app(scope, receive, send)
+
+app1.create_app()
+for name in quart_app.jinja_env.list_templates():
+    quart_app.jinja_env.get_template(name)
@@ -0,0 +1,72 @@
+# benchmarks/api_benchmarks.py
+"""End-to-end /api/generate throughput and latency against the fake image backend"""
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from timing import summarize
+
+
+def configure(fake_latency, fake_error_rate):
+    """Point the app at the fake backend and throwaway caches; call before importing app1"""
+    scratch = tempfile.mkdtemp(prefix="story-bench-")
+    os.environ["IMAGE_BACKEND"] = "fake"
+    os.environ["IMAGE_CACHE_DIR"] = os.path.join(scratch, "images")
+    os.environ["EXPORT_CACHE_DIR"] = os.path.join(scratch, "exports")
+    os.environ["FAKE_IMAGE_LATENCY"] = str(fake_latency)
+    os.environ["FAKE_IMAGE_ERROR_RATE"] = str(fake_error_rate)
+    os.environ.setdefault("FAKE_IMAGE_SEED", "0")
+    # Measure our own pipeline rather than the rate limits, unless asked otherwise
+    os.environ.setdefault("FAKE_IMAGE_RATE_LIMIT", "1000000")
+    os.environ.setdefault("FAKE_IMAGE_MAX_CONCURRENCY", "1000")
+    os.environ.setdefault("IMAGE_RATE_LIMIT", "1000000")
+    os.environ.setdefault("IMAGE_RATE_BURST", "1000")
+    os.environ.setdefault("IMAGE_RETRY_BASE_DELAY", "0.05")
+
+
+def run_level(app1, name, payloads, concurrency):
+    """POST every payload to /api/generate from ``concurrency`` threads at once"""
+    def post(payload):
+        client = app1.app.test_client()
+        started = time.perf_counter()
+        response = client.post("/api/generate", json=payload)
+        elapsed = time.perf_counter() - started
+        story = response.get_json(silent=True) or {}
+        images = sum(1 for scene in story.get("scenes", []) if scene.get("image_url") and not scene.get("image_pending"))
+        return elapsed, response.status_code == 200, images
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(post, payloads))
+    wall = time.perf_counter() - started
+    return summarize(
+        name,
+        [elapsed for elapsed, _, _ in outcomes],
+        metric="p95",
+        concurrency=concurrency,
+        requests=len(payloads),
+        errors=sum(1 for _, ok, _ in outcomes if not ok),
+        images=sum(images for _, _, images in outcomes),
+        throughput=len(payloads) / wall
+    )
+
+
+def run(quick=False, levels=(1, 4, 16), fake_latency=0.1, fake_error_rate=0.02):
+    configure(fake_latency, fake_error_rate)
+    import app1
+
+    results = []
+    for concurrency in levels:
+        count = max(concurrency * (2 if quick else 8), 4 if quick else 20)
+        # A made-up art style per request means every image is a cache miss;
+        # the seed makes the same request give the same story
+        payloads = [
+            {"story_idea": "A curious boy finds a strange compass in the old library", "genre": genre, "art_style": f"bench {concurrency} {i}", "seed": i}
+            for i, genre in zip(range(count), ["fantasy", "sci-fi", "mystery"] * count)
+        ]
+        results.append(run_level(app1, f"api.generate[cold,concurrency={concurrency}]", payloads, concurrency))
+        # The same requests again are served from the caches
+        results.append(run_level(app1, f"api.generate[warm,concurrency={concurrency}]", payloads, concurrency))
+    results[-1]["fake_backend"] = dict(app1.image_backend.stats)
+    return results
@@ -0,0 +1,59 @@
+# benchmarks/compare.py
+"""Compare two benchmark result files.
+
+    python benchmarks/compare.py baseline.json latest.json [--threshold 0.10]
+
+Exits with status 1 if any benchmark got slower than the threshold allows,
+or failed a check of its own (such as the startup benchmark finding the
+OpenAI SDK imported).
+"""
+import argparse
+import json
+import sys
+
+
+def failed_checks(results):
+    """Print the results whose own check failed (a "failed" reason); return their names"""
+    failed = [result for result in results if result.get("failed")]
+    for result in failed:
+        print(f"{result['name']:<60} FAILED: {result['failed']}")
+    return [result["name"] for result in failed]
+
+
+def report(baseline, current, threshold=0.10):
+    """Print the change of each benchmark in both runs; return the names that regressed or failed"""
+    before = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = before.get(result["name"])
+        if old is None:
+            print(f"{result['name']:<60} new")
+            continue
+        metric = result["metric"]
+        change = result[metric] / old[metric] - 1 if old[metric] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(result["name"])
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{result['name']:<60} {metric} {old[metric] * 1000:10.3f} -> {result[metric] * 1000:10.3f} ms {change:+7.1%}{flag}")
+    print(f"{len(regressions)} regression(s) over {threshold:.0%}")
+    return regressions + failed_checks(current["results"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    sys.exit(1 if report(baseline, current, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# benchmarks/run.py
+"""Run the benchmark suite and write the results as JSON.
+
+    python benchmarks/run.py                          # everything, to benchmarks/results/latest.json
+    python benchmarks/run.py --only text --quick      # just the text stages, fewer rounds
+    python benchmarks/run.py --baseline old.json      # also compare with an earlier run
+
+The API benchmarks use the fake image backend, so they need no API key or
+network. The startup benchmarks time importing and warming up the app in
+fresh interpreters, and fail the run if that imports the OpenAI SDK.
+Compare two result files on their own with benchmarks/compare.py.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import compare
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# The app's modules live one level up
+sys.path.insert(0, os.path.dirname(HERE))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", choices=["text", "api", "startup"], help="run one group of benchmarks")
+    parser.add_argument("--quick", action="store_true", help="fewer rounds and requests, for a fast check")
+    parser.add_argument("--levels", default="1,4,16", help="concurrency levels for the API benchmarks")
+    parser.add_argument("--fake-latency", type=float, default=0.1, help="median fake image call latency in seconds")
+    parser.add_argument("--fake-error-rate", type=float, default=0.02, help="share of fake image calls that fail")
+    parser.add_argument("--output", default=os.path.join(HERE, "results", "latest.json"))
+    parser.add_argument("--baseline", help="earlier results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown that counts as a regression (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    results = []
+    if args.only in (None, "text"):
+        import text_benchmarks
+        results += text_benchmarks.run(quick=args.quick)
+    if args.only in (None, "startup"):
+        # Before the API benchmarks, which point os.environ at the fake backend
+        import startup_benchmarks
+        results += startup_benchmarks.run(quick=args.quick)
+    if args.only in (None, "api"):
+        import api_benchmarks
+        levels = [int(level) for level in args.levels.split(",") if level]
+        results += api_benchmarks.run(quick=args.quick, levels=levels, fake_latency=args.fake_latency, fake_error_rate=args.fake_error_rate)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "quick": args.quick
+        },
+        "results": results
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for result in results:
+        print(f"{result['name']:<60} {result['metric']} {result[result['metric']] * 1000:10.3f} ms")
+    print("Results written to", args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare.report(baseline, report, args.threshold) else 0)
+    sys.exit(1 if compare.failed_checks(results) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# benchmarks/startup_benchmarks.py
+"""How long a fresh worker takes to import the app and warm it up"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from timing import summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a new interpreter each round, so nothing is imported yet
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import app1
+imported = time.perf_counter()
+app1.create_app()
+warmed = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "create_app": warmed - imported,
+    "modules": len(sys.modules),
+    "openai_imported": "openai" in sys.modules
+}))
+"""
+
+
+def start_worker(env):
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(quick=False):
+    rounds = 5 if quick else 20
+    scratch = tempfile.mkdtemp(prefix="story-bench-")
+    # The default backend, so a module-level import of the OpenAI SDK would show up here
+    env = dict(
+        os.environ,
+        IMAGE_BACKEND="openai",
+        LOG_LEVEL="WARNING",
+        IMAGE_CACHE_DIR=os.path.join(scratch, "images"),
+        EXPORT_CACHE_DIR=os.path.join(scratch, "exports"),
+        PROFILE_DIR=os.path.join(scratch, "profiles")
+    )
+    start_worker(env)  # Warm the OS file cache and the bytecode caches
+    workers = [start_worker(env) for _ in range(rounds)]
+    checks = {}
+    if any(worker["openai_imported"] for worker in workers):
+        # The SDK takes most of a second to import; it should wait for the first image call
+        checks["failed"] = "the OpenAI SDK was imported at startup"
+    return [
+        summarize(
+            "startup.import_app1", [worker["import"] for worker in workers],
+            modules=workers[-1]["modules"], openai_imported=workers[-1]["openai_imported"], **checks
+        ),
+        summarize("startup.create_app", [worker["create_app"] for worker in workers])
+    ]
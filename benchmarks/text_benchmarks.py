@@ -0,0 +1,82 @@
+# benchmarks/text_benchmarks.py
+"""Microbenchmarks of the story text stages in stories.py"""
+import random
+
+import stories
+from timing import measure
+
+IDEA = "A curious boy finds a strange compass in the old library and follows it into the ancient forest"
+
+
+def scene_text(genre="fantasy"):
+    return stories.STORY_TEMPLATES[genre][0]["scenes"][0]["text"]
+
+
+def grown_word_banks(factor):
+    """Word banks ``factor`` times their normal size, with made-up entries after the real ones"""
+    banks = dict(stories.WORD_BANKS)
+    if factor > 1:
+        for category, words in stories.WORD_BANKS.items():
+            banks[category] = list(words) + [f"{word} variant{i}" for i in range(1, factor) for word in words]
+    return banks
+
+
+def with_word_banks(banks, fn):
+    """Run fn with stories.WORD_BANKS swapped for ``banks``"""
+    original = stories.WORD_BANKS
+    stories.WORD_BANKS = banks
+    try:
+        stories.rebuild_keyword_index()
+        return fn()
+    finally:
+        stories.WORD_BANKS = original
+        stories.rebuild_keyword_index()
+
+
+def run(quick=False):
+    rounds = 5 if quick else 30
+    rng = random.Random(0)
+    results = []
+    keywords = stories.extract_keywords(IDEA, rng)
+
+    # fill_template: templates with more placeholders and more text
+    for size in (1, 4, 16):
+        template = " ".join([scene_text()] * size)
+        results.append(measure(
+            f"text.fill_template[size={size}]",
+            lambda: stories.fill_template(template, keywords, "fantasy", "dark", "kids", rng),
+            rounds=rounds, template_chars=len(template)
+        ))
+
+    # extract_keywords and whole stories with bigger word banks
+    for factor in (1, 10, 100):
+        banks = grown_word_banks(factor)
+
+        def bench_banks():
+            yield measure(
+                f"text.extract_keywords[banks=x{factor}]",
+                lambda: stories.extract_keywords(IDEA, rng), rounds=rounds
+            )
+            yield measure(
+                f"text.build_story[banks=x{factor}]",
+                lambda: stories.build_story(IDEA, "fantasy", "epic", "teens", "watercolor", rng), rounds=rounds
+            )
+
+        results += with_word_banks(banks, lambda: list(bench_banks()))
+
+    # Tone and audience transforms on short and long text
+    for size in (1, 16):
+        text = " ".join([scene_text("mystery")] * size)
+        for tone in stories.TONES:
+            results.append(measure(
+                f"text.transform_text[tone={tone},size={size}]",
+                lambda: stories.transform_text(text, tone, "kids", rng), rounds=rounds
+            ))
+
+    # Whole story text for each genre
+    for genre in stories.STORY_TEMPLATES:
+        results.append(measure(
+            f"text.build_story[genre={genre}]",
+            lambda: stories.build_story(IDEA, genre, "neutral", "adults", "realistic", rng), rounds=rounds
+        ))
+    return results
@@ -0,0 +1,52 @@
+# benchmarks/timing.py
+import time
+
+
+def percentile(samples, fraction):
+    """The given percentile (0.95 for p95) of a list of numbers"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(name, samples, metric="p50", **extra):
+    """Turn per-operation durations (seconds) into a result record"""
+    result = {
+        "name": name,
+        "unit": "s",
+        "metric": metric,  # the number compare.py looks at; lower is better
+        "count": len(samples),
+        "mean": sum(samples) / len(samples),
+        "min": min(samples),
+        "p50": percentile(samples, 0.50),
+        "p95": percentile(samples, 0.95),
+        "p99": percentile(samples, 0.99)
+    }
+    result.update(extra)
+    return result
+
+
+def measure(name, fn, rounds=30, number=None, min_time=0.02, **extra):
+    """Time ``fn()`` over ``rounds`` rounds, each running it ``number`` times.
+
+    ``number`` is picked so a round takes about ``min_time`` seconds when not
+    given; the samples are the per-call time of each round.
+    """
+    fn()  # Warm caches before timing
+    if number is None:
+        number = 1
+        while True:
+            started = time.perf_counter()
+            for _ in range(number):
+                fn()
+            if time.perf_counter() - started >= min_time or number >= 1_000_000:
+                break
+            number *= 2
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - started) / number)
+    result = summarize(name, samples, **extra)
+    result["ops_per_sec"] = 1 / result["p50"]
+    return result
@@ -0,0 +1,102 @@
+# config.py
+import os
+
+# Log level for the app and the libraries it uses: DEBUG, INFO, WARNING or ERROR
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG").upper()
+
+# Image generation
+# Where scene images come from: "openai", "placeholder" (stock pictures, no API key needed)
+# or "fake" (made locally, with API-like latency, errors and 429s, for load tests)
+IMAGE_BACKEND = os.environ.get("IMAGE_BACKEND", "openai")
+# Maximum number of scene images requested from the image API at the same time
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 8))
+IMAGE_MODEL = os.environ.get("IMAGE_MODEL", "gpt-image-1")
+# Generated images are square, this many pixels wide
+IMAGE_WIDTH = int(os.environ.get("IMAGE_WIDTH", 1024))
+# Seconds to wait for a single scene image before falling back to no image
+IMAGE_TIMEOUT = float(os.environ.get("IMAGE_TIMEOUT", 60))
+# Seconds the story page (/generate) waits for its images; later ones show a
+# placeholder until they are ready and are filled into the stored story then.
+# API requests wait up to IMAGE_TIMEOUT
+STORY_DEADLINE = float(os.environ.get("STORY_DEADLINE", 15))
+# Start a second call for an image still running past the p95 of recent calls (1 to enable)
+IMAGE_HEDGE = os.environ.get("IMAGE_HEDGE", "0") == "1"
+# Image API calls the async app (asgi.py) keeps in flight at once, across all API keys;
+# they wait on the event loop rather than holding a thread each
+ASYNC_IMAGE_CALLS = int(os.environ.get("ASYNC_IMAGE_CALLS", 256))
+# Image API calls a single /api/batch request keeps in flight at once
+BATCH_MAX_IN_FLIGHT = int(os.environ.get("BATCH_MAX_IN_FLIGHT", 16))
+# Maximum number of OpenAI clients (one per API key) kept alive for reuse
+OPENAI_CLIENT_POOL_SIZE = int(os.environ.get("OPENAI_CLIENT_POOL_SIZE", 32))
+# The fake backend: median call latency and its spread (lognormal sigma) in seconds, share
+# of calls failing with a 500, and calls per minute and at once allowed per key before 429s
+FAKE_IMAGE_OPTIONS = {
+    "latency": float(os.environ.get("FAKE_IMAGE_LATENCY", 2.0)),
+    "latency_sigma": float(os.environ.get("FAKE_IMAGE_LATENCY_SIGMA", 0.5)),
+    "error_rate": float(os.environ.get("FAKE_IMAGE_ERROR_RATE", 0.02)),
+    "rate_limit": float(os.environ.get("FAKE_IMAGE_RATE_LIMIT", 60)),
+    "max_concurrency": int(os.environ.get("FAKE_IMAGE_MAX_CONCURRENCY", 5)),
+    "seed": int(os.environ["FAKE_IMAGE_SEED"]) if os.environ.get("FAKE_IMAGE_SEED") else None
+}
+# Image API calls allowed per minute for each API key, and how many may be made in one burst
+IMAGE_RATE_LIMIT = float(os.environ.get("IMAGE_RATE_LIMIT", 50))
+IMAGE_RATE_BURST = int(os.environ.get("IMAGE_RATE_BURST", 10))
+# Retries of an image call the API turned away (429 or 5xx), with backoff between
+# IMAGE_RETRY_BASE_DELAY and IMAGE_RETRY_MAX_DELAY seconds
+IMAGE_MAX_RETRIES = int(os.environ.get("IMAGE_MAX_RETRIES", 4))
+IMAGE_RETRY_BASE_DELAY = float(os.environ.get("IMAGE_RETRY_BASE_DELAY", 1))
+IMAGE_RETRY_MAX_DELAY = float(os.environ.get("IMAGE_RETRY_MAX_DELAY", 30))
+
+# Image cache
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_cache"))
+IMAGE_CACHE_MEMORY_ENTRIES = int(os.environ.get("IMAGE_CACHE_MEMORY_ENTRIES", 1024))
+IMAGE_CACHE_DISK_BYTES = int(os.environ.get("IMAGE_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+# Seconds before a cached image is generated again
+IMAGE_CACHE_TTL = int(os.environ.get("IMAGE_CACHE_TTL", 7 * 24 * 3600))
+# Seconds browsers may keep a served image without asking again
+IMAGE_MAX_AGE = int(os.environ.get("IMAGE_MAX_AGE", 365 * 24 * 3600))
+
+# Responsive image variants (needs Pillow); formats this Pillow build can't write are skipped
+IMAGE_VARIANT_WIDTHS = [int(width) for width in os.environ.get("IMAGE_VARIANT_WIDTHS", "256,512,768").split(",") if width]
+IMAGE_VARIANT_FORMATS = [fmt for fmt in os.environ.get("IMAGE_VARIANT_FORMATS", "avif,webp").split(",") if fmt]
+IMAGE_VARIANT_WORKERS = int(os.environ.get("IMAGE_VARIANT_WORKERS", 2))
+
+# Background story jobs (/api/jobs)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+# Jobs allowed to wait for a worker before new ones are turned away
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", 100))
+# Seconds a finished job's result is kept
+JOB_TTL = int(os.environ.get("JOB_TTL", 3600))
+
+# /api/generate results kept for retries sent with the same Idempotency-Key header:
+# for this many seconds, and at most this many of them
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", 24 * 3600))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", 10000))
+
+# Seeded stories kept whole, so repeating a request with the same seed needs no image calls
+STORY_CACHE_ENTRIES = int(os.environ.get("STORY_CACHE_ENTRIES", 1000))
+STORY_CACHE_TTL = int(os.environ.get("STORY_CACHE_TTL", 24 * 3600))
+
+# Where generated stories are kept: "memory", "sqlite:///path/to/stories.db" or "redis://host:port/db"
+STORY_STORE = os.environ.get("STORY_STORE", "memory")
+# Stories kept by the in-process store before the least recently viewed are dropped
+STORY_STORE_MAX_ENTRIES = int(os.environ.get("STORY_STORE_MAX_ENTRIES", 1000))
+# Seconds a story is kept (0 keeps stories until they are evicted)
+STORY_TTL = int(os.environ.get("STORY_TTL", 7 * 24 * 3600))
+
+# Story exports (/download-pdf); finished files are kept so repeat downloads come from disk
+EXPORT_CACHE_DIR = os.environ.get("EXPORT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "export_cache"))
+EXPORT_CACHE_MAX_FILES = int(os.environ.get("EXPORT_CACHE_MAX_FILES", 200))
+# Threads preparing pictures and pages for exports
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", 2))
+
+# Admin routes (/admin/...) need this token in an "Authorization: Bearer <token>" header;
+# they are turned off while it is empty
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Request profiling: requests sent with an "X-Profile: <ADMIN_TOKEN>" header run under
+# cProfile, and so does this share of all requests (0 turns sampling off); the most
+# recent PROFILE_MAX_FILES profiles are kept and listed on /admin/profiles
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 50))
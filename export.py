@@ -0,0 +1,365 @@
+# export.py
+import hashlib
+import html
+import io
+import json
+import os
+import textwrap
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow, PDFs are exported without pictures
+    Image = None
+
+FORMATS = {
+    "pdf": "application/pdf",
+    "epub": "application/epub+zip"
+}
+
+# PDF page layout, in points (A4)
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 56
+TITLE_SIZE = 20
+BODY_SIZE = 11
+LEADING = 16
+# Helvetica averages about half an em per character
+CHARS_PER_LINE = int((PAGE_WIDTH - 2 * MARGIN) / (BODY_SIZE * 0.5))
+IMAGE_MAX_HEIGHT = 340
+
+
+class Exporter:
+    """Exports stories as PDF or EPUB, streamed while they are being laid out.
+
+    Only a few scenes are held in memory at once: pictures are prepared in a
+    small worker pool a couple of scenes ahead of the writer, and every
+    finished export is kept on disk so downloading it again just sends the file.
+    """
+
+    def __init__(self, directory, image_path, workers=2, prefetch=2, max_files=200):
+        self.directory = directory
+        # Maps an image URL to a local file, or None for images we don't have
+        self.image_path = image_path
+        self.prefetch = prefetch
+        self.max_files = max_files
+        self.workers = workers
+        self._executor = None  # Started with the first export
+        self._lock = threading.Lock()
+
+    def cached_path(self, story_ids, stories, fmt):
+        """Return the file of an earlier export of these stories, if there is one"""
+        path = self._path(story_ids, stories, fmt)
+        return path if os.path.isfile(path) else None
+
+    def stream(self, story_ids, stories, fmt):
+        """Yield the export piece by piece, saving it to the cache as it goes"""
+        path = self._path(story_ids, stories, fmt)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        chunks = self._pdf(stories) if fmt == "pdf" else self._epub(stories)
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+        finally:
+            # Client went away or something failed: don't leave half a file behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._trim()
+
+    def _path(self, story_ids, stories, fmt):
+        name = story_ids[0] if len(story_ids) == 1 else hashlib.sha256("+".join(story_ids).encode("utf-8")).hexdigest()[:24]
+        # Include the content too, so a story that gained images later is exported again
+        digest = hashlib.sha256(json.dumps(stories, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, f"{name}-{digest}.{fmt}")
+
+    def _trim(self):
+        # Keep only the most recent exports
+        with self._lock:
+            files = [entry for entry in os.scandir(self.directory) if entry.is_file() and not entry.name.endswith(".tmp")]
+            if len(files) <= self.max_files:
+                return
+            files.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in files[:len(files) - self.max_files]:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def _prefetched(self, fn, items):
+        """Map fn over items in the worker pool, in order, a few items ahead of the caller"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export")
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(self._executor.submit(fn, item))
+                if len(pending) > self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    # PDF
+
+    def _pdf(self, stories):
+        """Write a PDF one object at a time.
+
+        PDF readers find objects through the cross-reference table at the end
+        of the file, so pages can be written as soon as they are laid out and
+        the page tree that lists them written last.
+        """
+        offsets = {}
+        position = 0
+
+        def write(number, body, stream=None):
+            nonlocal position
+            offsets[number] = position
+            data = f"{number} 0 obj\n".encode() + body
+            if stream is not None:
+                data += b"\nstream\n" + stream + b"\nendstream"
+            data += b"\nendobj\n"
+            position += len(data)
+            return data
+
+        header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        position = len(header)
+        yield header
+        # 1: catalog, 2: page tree (written last), 3-4: fonts
+        yield write(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        yield write(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        yield write(4, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+        next_number = 5
+        pages = []
+
+        for laid_out in self._prefetched(self._layout_scene, _scenes(stories)):
+            for content, image in laid_out:
+                resources = b"/Font << /F1 3 0 R /F2 4 0 R >>"
+                if image is not None:
+                    jpeg, width, height = image
+                    image_number = next_number
+                    next_number += 1
+                    yield write(image_number, (
+                        f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                        f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length {len(jpeg)} >>"
+                    ).encode(), jpeg)
+                    resources += f" /XObject << /Im1 {image_number} 0 R >>".encode()
+                content_number, page_number = next_number, next_number + 1
+                next_number += 2
+                yield write(content_number, f"<< /Length {len(content)} >>".encode(), content)
+                yield write(page_number, (
+                    f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                    f"/Contents {content_number} 0 R /Resources << "
+                ).encode() + resources + b" >> >>")
+                pages.append(page_number)
+
+        kids = " ".join(f"{number} 0 R" for number in pages)
+        yield write(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+
+        xref = [f"xref\n0 {next_number}\n", "0000000000 65535 f \n"]
+        for number in range(1, next_number):
+            xref.append(f"{offsets.get(number, 0):010d} 00000 n \n")
+        xref.append(f"trailer\n<< /Size {next_number} /Root 1 0 R >>\nstartxref\n{position}\n%%EOF\n")
+        yield "".join(xref).encode()
+
+    def _layout_scene(self, entry):
+        """Lay out one scene (or a story's title page) as PDF pages of (content, image); runs in the pool"""
+        story, scene = entry
+        y = PAGE_HEIGHT - MARGIN - TITLE_SIZE
+        if scene is None:
+            ops = [_pdf_text([story.get("title", "")], "F2", TITLE_SIZE, MARGIN, y - 200, TITLE_SIZE * 1.4, CHARS_PER_LINE // 2)]
+            if story.get("idea"):
+                ops.append(_pdf_text([f'Based on: "{story["idea"]}"'], "F1", BODY_SIZE, MARGIN, y - 260, LEADING))
+            return [(b"\n".join(ops), None)]
+
+        ops = [_pdf_text([scene.get("title", "")], "F2", TITLE_SIZE, MARGIN, y, TITLE_SIZE * 1.4)]
+        y -= TITLE_SIZE * 2
+        image = self._pdf_image(scene.get("image_url"))
+        if image is not None:
+            _, width, height = image
+            scale = min((PAGE_WIDTH - 2 * MARGIN) / width, IMAGE_MAX_HEIGHT / height)
+            shown_width, shown_height = width * scale, height * scale
+            y -= shown_height
+            ops.append(f"q {shown_width:.2f} 0 0 {shown_height:.2f} {MARGIN} {y:.2f} cm /Im1 Do Q".encode())
+            y -= LEADING * 2
+
+        lines = textwrap.wrap(scene.get("text", ""), CHARS_PER_LINE)
+        pages = []
+        while True:
+            fit = max(1, int((y - MARGIN) // LEADING))
+            ops.append(_pdf_text(lines[:fit], "F1", BODY_SIZE, MARGIN, y, LEADING))
+            pages.append((b"\n".join(ops), image))
+            lines = lines[fit:]
+            if not lines:
+                return pages
+            # Text that doesn't fit continues on a fresh page
+            ops, image, y = [], None, PAGE_HEIGHT - MARGIN - BODY_SIZE
+
+    def _pdf_image(self, url):
+        """Re-encode a scene image as a JPEG a PDF can embed directly, or None"""
+        path = self.image_path(url) if url else None
+        if Image is None or path is None:
+            return None
+        try:
+            with Image.open(path) as image:
+                image = image.convert("RGB")
+                image.thumbnail((1024, 1024))
+                buffer = io.BytesIO()
+                image.save(buffer, format="JPEG", quality=85)
+                return buffer.getvalue(), image.width, image.height
+        except OSError as e:
+            print("Export image failed:", e)
+            return None
+
+    # EPUB
+
+    def _epub(self, stories):
+        """Write an EPUB zip entry by entry; the manifest goes last once every file is known"""
+        sink = _ChunkSink()
+        book_id = f"urn:uuid:{uuid.uuid4()}"
+        manifest = []
+        spine = []
+
+        # The mimetype has to be the first entry, stored uncompressed with its
+        # size and CRC in the header. zipfile can't go back to fill those in
+        # on a stream, so write this entry ourselves and let zipfile carry on
+        mimetype = _stored_entry("mimetype", b"application/epub+zip")
+        sink.write(mimetype.FileHeader() + b"application/epub+zip")
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as book:
+            book.filelist.append(mimetype)
+            book.NameToInfo[mimetype.filename] = mimetype
+            book.writestr("META-INF/container.xml", (
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>'
+                '</container>'
+            ))
+            yield sink.drain()
+
+            for story_index, story in enumerate(stories):
+                body = [f"<h1>{html.escape(story.get('title', ''))}</h1>"]
+                if story.get("idea"):
+                    body.append(f"<p><em>Based on: &quot;{html.escape(story['idea'])}&quot;</em></p>")
+                for scene_index, scene in enumerate(story.get("scenes", [])):
+                    body.append(f"<h2>{html.escape(scene.get('title', ''))}</h2>")
+                    path = self.image_path(scene["image_url"]) if scene.get("image_url") else None
+                    media_type = _EPUB_IMAGE_TYPES.get(os.path.splitext(path)[1].lower()) if path else None
+                    if media_type:
+                        name = f"images/story{story_index}-scene{scene_index}{os.path.splitext(path)[1].lower()}"
+                        # Copy the file across in pieces rather than loading it whole
+                        with open(path, "rb") as source, book.open(f"OEBPS/{name}", "w") as target:
+                            while True:
+                                chunk = source.read(64 * 1024)
+                                if not chunk:
+                                    break
+                                target.write(chunk)
+                                yield sink.drain()
+                        manifest.append((f"img{story_index}-{scene_index}", name, media_type))
+                        body.append(f'<p><img src="{name}" alt="{html.escape(scene.get("title", ""))}"/></p>')
+                    body.append(f"<p>{html.escape(scene.get('text', ''))}</p>")
+                name = f"story{story_index}.xhtml"
+                book.writestr(f"OEBPS/{name}", _xhtml(story.get("title", ""), "\n".join(body)))
+                manifest.append((f"story{story_index}", name, "application/xhtml+xml"))
+                spine.append((f"story{story_index}", story.get("title", "")))
+                yield sink.drain()
+
+            title = stories[0].get("title", "Stories") if len(stories) == 1 else "Stories"
+            toc = "".join(f'<li><a href="story{index}.xhtml">{html.escape(story_title)}</a></li>' for index, (_, story_title) in enumerate(spine))
+            book.writestr("OEBPS/nav.xhtml", _xhtml(title, f'<nav epub:type="toc"><ol>{toc}</ol></nav>'))
+            items = "".join(f'<item id="{item_id}" href="{href}" media-type="{media_type}"/>' for item_id, href, media_type in manifest)
+            itemrefs = "".join(f'<itemref idref="{item_id}"/>' for item_id, _ in spine)
+            book.writestr("OEBPS/content.opf", (
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">'
+                '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+                f'<dc:identifier id="book-id">{book_id}</dc:identifier>'
+                f'<dc:title>{html.escape(title)}</dc:title><dc:language>en</dc:language>'
+                f'<meta property="dcterms:modified">{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}</meta>'
+                '</metadata>'
+                f'<manifest><item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>{items}</manifest>'
+                f'<spine>{itemrefs}</spine>'
+                '</package>'
+            ))
+        yield sink.drain()
+
+
+_EPUB_IMAGE_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif"
+}
+
+
+def _stored_entry(name, data):
+    """A zip entry for ``data`` stored as is, with its CRC and sizes filled in"""
+    info = zipfile.ZipInfo(name)
+    info.compress_type = zipfile.ZIP_STORED
+    info.CRC = zlib.crc32(data)
+    info.file_size = info.compress_size = len(data)
+    info.header_offset = 0
+    return info
+
+
+class _ChunkSink:
+    """A write-only file for zipfile whose contents are handed out as they are written"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _scenes(stories):
+    # A title page for each story, then its scenes
+    for story in stories:
+        yield story, None
+        for scene in story.get("scenes", []):
+            yield story, scene
+
+
+def _pdf_text(lines, font, size, x, y, leading, width=None):
+    if width:
+        lines = [wrapped for line in lines for wrapped in textwrap.wrap(line, width)]
+    ops = [f"BT /{font} {size} Tf {leading} TL {x} {y:.2f} Td".encode()]
+    for line in lines:
+        data = line.encode("cp1252", "replace")
+        data = data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+        ops.append(b"(" + data + b") Tj T*")
+    ops.append(b"ET")
+    return b"\n".join(ops)
+
+
+def _xhtml(title, body):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+        f"<head><title>{html.escape(title)}</title></head><body>{body}</body></html>"
+    )
@@ -0,0 +1,106 @@
+# idempotency.py
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Longest Idempotency-Key header accepted
+MAX_KEY_LENGTH = 255
+
+
+class KeyReused(Exception):
+    pass
+
+
+class _Entry:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.future = Future()
+        self.expires_at = None  # Set once the result is in
+
+
+def scoped_key(key, scope):
+    """The key to remember a request by: its Idempotency-Key header within ``scope``, whose requests they are"""
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters.")
+    return f"{scope}:{key}"
+
+
+def request_fingerprint(data):
+    """A hash of a JSON request body, to tell a retry from a different request reusing its key"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """Results of requests sent with an Idempotency-Key, so a retry gets the first attempt's result.
+
+    A retry that arrives while the first attempt is still running waits for
+    it. Results are kept for ``ttl`` seconds, and only the ``max_entries``
+    most recent; requests still running are never dropped. A request that
+    fails with an exception isn't remembered, so its retry runs again.
+    """
+
+    def __init__(self, max_entries=10000, ttl=24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._running = {}  # key -> _Entry
+        self._results = OrderedDict()  # key -> _Entry, oldest first
+        self._lock = threading.Lock()
+
+    def claim(self, key, fingerprint):
+        """Return (future, leader) for a key.
+
+        The leader must run the request and pass its result to ``finish``, or
+        its exception to ``fail``; everyone else waits on the future. Raises
+        KeyReused if the key was used for a request with another fingerprint.
+        """
+        with self._lock:
+            self._expire()
+            entry = self._results.get(key) or self._running.get(key)
+            if entry is not None:
+                if entry.fingerprint != fingerprint:
+                    raise KeyReused("This Idempotency-Key was already used for a different request.")
+                return entry.future, False
+            entry = self._running[key] = _Entry(fingerprint)
+            return entry.future, True
+
+    def finish(self, key, future, result):
+        with self._lock:
+            entry = self._running.get(key)
+            if entry is not None and entry.future is future:
+                del self._running[key]
+                entry.expires_at = time.time() + self.ttl
+                self._results[key] = entry
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        future.set_result(result)
+
+    def fail(self, key, future, error):
+        with self._lock:
+            entry = self._running.get(key)
+            if entry is not None and entry.future is future:
+                del self._running[key]
+        future.set_exception(error)
+
+    def run(self, key, fingerprint, fn, *args, **kwargs):
+        """Return (``fn(*args, **kwargs)``, False), or (the earlier result for the key, True)"""
+        future, leader = self.claim(key, fingerprint)
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.fail(key, future, e)
+            raise
+        self.finish(key, future, result)
+        return result, False
+
+    def _expire(self):
+        now = time.time()
+        while self._results:
+            key, entry = next(iter(self._results.items()))
+            if entry.expires_at > now:
+                break
+            del self._results[key]
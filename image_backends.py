@@ -0,0 +1,233 @@
+# image_backends.py
+import abc
+import asyncio
+import base64
+import hashlib
+import math
+import random
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from types import SimpleNamespace
+
+from stories import placeholder_image_url
+
+
+class ImageBackend(abc.ABC):
+    """Where scene images come from.
+
+    ``generate`` returns an image the way the OpenAI images API does, as an
+    object with ``b64_json`` or ``url``; those calls go through the rate
+    scheduler and the image cache. A backend whose pictures need no
+    generating returns a URL from ``direct_url`` instead and skips both.
+    """
+
+    name = None
+
+    def direct_url(self, prompt, style):
+        return None
+
+    def scene_prompt(self, scene):
+        """The prompt a scene's picture is made from"""
+        return scene["text"]
+
+    @abc.abstractmethod
+    def generate(self, prompt, style, api_key=None):
+        pass
+
+    async def generate_async(self, prompt, style, api_key=None):
+        """``generate`` for the async app; backends with a native async client override it"""
+        return await asyncio.to_thread(self.generate, prompt, style, api_key)
+
+
+class OpenAIBackend(ImageBackend):
+    """Generates images with the OpenAI images API, using each user's own API key"""
+
+    name = "openai"
+
+    def __init__(self, model="gpt-image-1", size=1024, timeout=60.0, client_pool_size=32):
+        self.model = model
+        self.size = size
+        self.timeout = timeout
+        self.client_pool_size = client_pool_size
+        # Clients are reused across requests so their HTTP connection pools stay warm.
+        # Keyed by a hash of the API key so raw keys are not kept as dict keys.
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def client(self, api_key, asynchronous=False):
+        """Get the client for a key, creating it on first use; ``asynchronous`` gets an AsyncOpenAI one"""
+        if not api_key:
+            raise RuntimeError("API key not set. Please provide your OpenAI API key.")
+        from openai import AsyncOpenAI, OpenAI  # Only needed when this backend is configured
+        pool_key = (hashlib.sha256(api_key.encode("utf-8")).hexdigest(), asynchronous)
+        with self._lock:
+            client = self._clients.get(pool_key)
+            if client is not None:
+                self._clients.move_to_end(pool_key)
+                return client
+            # Retries are left to the rate scheduler, which backs off across all calls for the key
+            client = (AsyncOpenAI if asynchronous else OpenAI)(api_key=api_key, max_retries=0)
+            self._clients[pool_key] = client
+            # Drop the least recently used clients; any call still using one
+            # finishes normally and the client is closed once it is garbage collected
+            while len(self._clients) > self.client_pool_size:
+                self._clients.popitem(last=False)
+            return client
+
+    def generate(self, prompt, style, api_key=None):
+        response = self.client(api_key).images.generate(
+            model=self.model,
+            prompt=f"{prompt}, style {style}",
+            size=f"{self.size}x{self.size}",
+            timeout=self.timeout
+        )
+        return response.data[0]
+
+    async def generate_async(self, prompt, style, api_key=None):
+        response = await self.client(api_key, asynchronous=True).images.generate(
+            model=self.model,
+            prompt=f"{prompt}, style {style}",
+            size=f"{self.size}x{self.size}",
+            timeout=self.timeout
+        )
+        return response.data[0]
+
+
+class PlaceholderBackend(ImageBackend):
+    """Stock pictures from picsum.photos; needs no API key"""
+
+    name = "placeholder"
+
+    def direct_url(self, prompt, style):
+        return placeholder_image_url(prompt, style)
+
+    def scene_prompt(self, scene):
+        # Stock pictures have always been picked by the image prompt
+        return scene["image_prompt"]
+
+    def generate(self, prompt, style, api_key=None):
+        # Not called by the app, which uses direct_url, but keeps the backend complete
+        return SimpleNamespace(b64_json=None, url=self.direct_url(prompt, style))
+
+
+class FakeAPIError(Exception):
+    """Looks enough like an OpenAI API error for the scheduler to treat it the same way"""
+
+    def __init__(self, status_code, message, retry_after=None):
+        super().__init__(f"Error code: {status_code} - {message}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)} if retry_after else {})
+
+
+class FakeBackend(ImageBackend):
+    """Makes plain images locally, behaving like a busy image API: for load tests and benchmarks.
+
+    Call latency is lognormal around ``latency`` seconds, ``error_rate`` of
+    calls fail with a 500, and each key may make ``rate_limit`` calls a
+    minute with at most ``max_concurrency`` at once before getting 429s.
+    Nothing goes over the network and no API key is needed.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency=2.0, latency_sigma=0.5, error_rate=0.02, rate_limit=60, max_concurrency=5,
+                 size=1024, timeout=60.0, seed=None):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.max_concurrency = max_concurrency
+        self.size = size
+        self.timeout = timeout
+        self._random = random.Random(seed)
+        self._keys = {}  # key -> [tokens, last refill, calls in flight]
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "ok": 0, "throttled": 0, "errors": 0, "timeouts": 0}
+
+    def generate(self, prompt, style, api_key=None):
+        bucket, wait, error, outcome = self._admit(api_key)
+        try:
+            time.sleep(wait)
+        finally:
+            self._release(bucket, outcome)
+        if error is not None:
+            raise error
+        return self._image(prompt, style)
+
+    async def generate_async(self, prompt, style, api_key=None):
+        bucket, wait, error, outcome = self._admit(api_key)
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            self._release(bucket, outcome)
+        if error is not None:
+            raise error
+        # Until its colour is cached, making the PNG takes milliseconds of CPU
+        return await asyncio.to_thread(self._image, prompt, style)
+
+    def _admit(self, api_key):
+        # Decide how a call goes: how long it takes, and the error it ends with, if any
+        with self._lock:
+            self.stats["calls"] += 1
+            now = time.monotonic()
+            # The same token bucket the real API applies per key
+            bucket = self._keys.setdefault(api_key, [float(self.max_concurrency), now, 0])
+            bucket[0] = min(self.max_concurrency, bucket[0] + (now - bucket[1]) * self.rate_limit / 60)
+            bucket[1] = now
+            if bucket[0] < 1 or bucket[2] >= self.max_concurrency:
+                self.stats["throttled"] += 1
+                raise FakeAPIError(429, "Rate limit reached for images", retry_after=math.ceil((1 - bucket[0]) * 60 / self.rate_limit) if bucket[0] < 1 else 1)
+            bucket[0] -= 1
+            bucket[2] += 1
+            latency = self._random.lognormvariate(math.log(self.latency), self.latency_sigma) if self.latency > 0 else 0
+            failed = self._random.random() < self.error_rate
+        if latency > self.timeout:
+            return bucket, self.timeout, TimeoutError("Request timed out."), "timeouts"
+        if failed:
+            return bucket, latency, FakeAPIError(500, "The server had an error while processing your request."), "errors"
+        return bucket, latency, None, "ok"
+
+    def _release(self, bucket, outcome):
+        with self._lock:
+            bucket[2] -= 1
+            self.stats[outcome] += 1
+
+    def _image(self, prompt, style):
+        # A flat colour picked from the prompt, so different scenes look different.
+        # Only the 216 web-safe colours, so every PNG stays cached in solid_png
+        digest = hashlib.sha256(f"{prompt}, style {style}".encode("utf-8")).digest()
+        rgb = bytes(value % 6 * 51 for value in digest[:3])
+        return SimpleNamespace(b64_json=base64.b64encode(solid_png(self.size, rgb)).decode("ascii"), url=None)
+
+
+@lru_cache(maxsize=256)
+def solid_png(size, rgb):
+    """A square PNG of one colour"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    rows = (b"\x00" + bytes(rgb) * size) * size
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+def open_image_backend(name, model="gpt-image-1", size=1024, timeout=60.0, client_pool_size=32, fake_options=None):
+    """Create the image backend named in the config.
+
+    "openai" calls the OpenAI images API, "placeholder" uses stock pictures
+    and "fake" imitates the API locally (see FakeBackend for ``fake_options``).
+    """
+    if name == "openai":
+        return OpenAIBackend(model=model, size=size, timeout=timeout, client_pool_size=client_pool_size)
+    if name == "placeholder":
+        return PlaceholderBackend()
+    if name == "fake":
+        return FakeBackend(size=size, timeout=timeout, **(fake_options or {}))
+    raise ValueError(f"Unknown image backend: {name}")
@@ -0,0 +1,229 @@
+# image_cache.py
+import glob
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(prompt, style, model):
+    """Build a stable key for an image request from its prompt, style and model"""
+    # Case and runs of whitespace don't change the picture, so ignore them
+    normalized = " ".join(prompt.lower().split())
+    raw = "\n".join([model, style.strip().lower(), normalized])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def sniff_extension(data):
+    """Guess an image's file extension from its first bytes"""
+    if data.startswith(b"\xff\xd8"):
+        return "jpg"
+    if data.startswith(b"RIFF") and data[8:12] == b"WEBP":
+        return "webp"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    return "png"
+
+
+def key_of(filename):
+    """The cache key an image file, or one of its variants, was stored under"""
+    # Files are named <key>-<content hash>.<extension>, variants <key>-<content hash>-<width>.<format>
+    return filename.split(".", 1)[0].split("-", 1)[0]
+
+
+class ImageCache:
+    """Two-tier cache of generated images.
+
+    The disk tier keeps the image files themselves, bounded by total size.
+    Each file is named after its key and a hash of its bytes, so an image
+    made again for the same key gets a new URL and a file never changes.
+    The memory tier remembers which keys are on disk so hot keys skip most
+    of the filesystem work. Both tiers expire entries after ``ttl`` seconds.
+
+    Several processes (e.g. gunicorn workers) may share the directory. A key
+    missing from this process's index is looked for on disk, and storing an
+    image rescans the directory, at most every ``rescan_interval`` seconds
+    or when over the size bound, so eviction counts every process's files.
+    """
+
+    def __init__(self, directory, url_prefix="/images", max_memory_entries=1024, max_disk_bytes=512 * 1024 * 1024, ttl=7 * 24 * 3600,
+                 rescan_interval=1.0):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.rescan_interval = rescan_interval
+        self._memory = OrderedDict()  # key -> (filename, expires_at)
+        self._disk = None  # key -> (filename, size), least recently used first; loaded lazily
+        self._disk_bytes = 0
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        # Called with the filename of each image removed from disk
+        self.on_evict = None
+
+    def url_for(self, filename):
+        return f"{self.url_prefix}/{filename}"
+
+    def get(self, key, count=True):
+        """Return the local URL for a cached image, or None; ``count=False`` leaves it out of the stats"""
+        now = time.time()
+        with self._lock:
+            disk = self._load_disk()
+            entry = self._memory.get(key)
+            if entry is not None:
+                # Another process may have evicted the file, so check it is still there
+                if entry[1] > now and os.path.isfile(os.path.join(self.directory, entry[0])):
+                    self._memory.move_to_end(key)
+                    if key in disk:
+                        disk.move_to_end(key)
+                    if count:
+                        self.stats["memory_hits"] += 1
+                    return self.url_for(entry[0])
+                del self._memory[key]
+
+            # A second look picks up a copy another process made after this
+            # one's went missing or expired
+            for _ in range(2):
+                if key not in disk and not self._find(key):
+                    break
+                filename, size = disk[key]
+                try:
+                    expires_at = os.path.getmtime(os.path.join(self.directory, filename)) + self.ttl
+                except OSError:
+                    expires_at = 0
+                if expires_at > now:
+                    disk.move_to_end(key)
+                    self._remember(key, filename, expires_at)
+                    if count:
+                        self.stats["disk_hits"] += 1
+                    return self.url_for(filename)
+                self._drop_disk(key)
+
+            if count:
+                self.stats["misses"] += 1
+            return None
+
+    def put(self, key, data):
+        """Store image bytes under ``key`` and return their local URL"""
+        return self.put_chunks(key, [data])
+
+    def put_chunks(self, key, chunks):
+        """Store an image given as an iterable of byte chunks and return its local URL.
+
+        Chunks go straight to disk, so the whole image is never held in memory.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary name first so readers never see a partial file
+        tmp_path = os.path.join(self.directory, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        size = 0
+        extension = "png"
+        digest = hashlib.sha256()
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    if size == 0 and chunk:
+                        extension = sniff_extension(chunk)
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            filename = f"{key}-{digest.hexdigest()[:16]}.{extension}"
+            os.replace(tmp_path, os.path.join(self.directory, filename))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            disk = self._load_disk()
+            if key in disk:
+                old_filename, old_size = disk.pop(key)
+                self._disk_bytes -= old_size
+                if old_filename != filename:
+                    self._remove(old_filename)
+            disk[key] = (filename, size)
+            self._disk_bytes += size
+            if self._disk_bytes > self.max_disk_bytes or time.monotonic() - self._scanned_at >= self.rescan_interval:
+                # Count the files other processes have stored before evicting
+                disk = self._load_disk(rescan=True)
+                # If another process stored the key just now too, the newer file wins
+                filename = disk[key][0] if key in disk else filename
+            while self._disk_bytes > self.max_disk_bytes and len(disk) > 1:
+                oldest = next(iter(disk))
+                self._drop_disk(oldest)
+                self.stats["evictions"] += 1
+            self._remember(key, filename, time.time() + self.ttl)
+            return self.url_for(filename)
+
+    def _remember(self, key, filename, expires_at):
+        self._memory[key] = (filename, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _load_disk(self, rescan=False):
+        """The disk index, read from the directory on first use or when ``rescan`` is set"""
+        if self._disk is not None and not rescan:
+            return self._disk
+        found = []
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # Removed by another process just now
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+        # Least recently written first, then the keys this process has used
+        # in the order it last used them
+        used = list(self._disk or ())
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        for _, filename, size in sorted(found):
+            key = key_of(filename)
+            if key in self._disk:
+                # An older copy, from processes that stored the key at the same time
+                self._drop_disk(key)
+            self._disk[key] = (filename, size)
+            self._disk_bytes += size
+        for key in used:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+        self._scanned_at = time.monotonic()
+        return self._disk
+
+    def _find(self, key):
+        """Add the newest file on disk for ``key`` to the disk index; False if there is none"""
+        found = []
+        for path in glob.glob(os.path.join(glob.escape(self.directory), glob.escape(key) + "[-.]*")):
+            filename = os.path.basename(path)
+            if filename.endswith(".tmp") or key_of(filename) != key:
+                continue
+            try:
+                found.append((os.path.getmtime(path), filename, os.path.getsize(path)))
+            except OSError:
+                continue
+        if not found:
+            return False
+        _, filename, size = max(found)
+        self._disk[key] = (filename, size)
+        self._disk_bytes += size
+        return True
+
+    def _drop_disk(self, key):
+        filename, size = self._disk.pop(key)
+        self._disk_bytes -= size
+        self._memory.pop(key, None)
+        self._remove(filename)
+
+    def _remove(self, filename):
+        try:
+            os.remove(os.path.join(self.directory, filename))
+        except OSError:
+            pass
+        if self.on_evict is not None:
+            self.on_evict(filename)
@@ -0,0 +1,124 @@
+# image_variants.py
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image, features
+except ImportError:  # Variants are optional; without Pillow the full-size images are used
+    Image = None
+
+# Pillow format names and MIME types for the variant formats we know how to make
+FORMATS = {
+    "avif": ("AVIF", "image/avif"),
+    "webp": ("WEBP", "image/webp")
+}
+
+
+def supported_formats(formats):
+    """Keep the formats this Pillow build can write"""
+    if Image is None:
+        return []
+    return [fmt for fmt in formats if fmt in FORMATS and features.check(fmt)]
+
+
+def variant_name(filename, width, fmt):
+    key = filename.rsplit(".", 1)[0]
+    return f"{key}-{width}.{fmt}"
+
+
+def make_variants(directory, filename, variant_directory, widths, formats, quality=80):
+    """Write resized copies of an image in each format; runs in a worker process"""
+    os.makedirs(variant_directory, exist_ok=True)
+    with Image.open(os.path.join(directory, filename)) as image:
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        for width in widths:
+            if width >= image.width:
+                continue
+            height = round(image.height * width / image.width)
+            resized = image.resize((width, height), Image.LANCZOS)
+            for fmt in formats:
+                path = os.path.join(variant_directory, variant_name(filename, width, fmt))
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                resized.save(tmp_path, format=FORMATS[fmt][0], quality=quality)
+                os.replace(tmp_path, path)
+
+
+class VariantPipeline:
+    """Makes smaller WebP/AVIF copies of stored images in a pool of worker processes.
+
+    Variants live in ``<image directory>/variants`` and are made in the
+    background; until they exist the full-size image is served in their place.
+    """
+
+    def __init__(self, directory, widths=(256, 512, 768), formats=("webp",), workers=2):
+        self.directory = directory
+        self.variant_directory = os.path.join(directory, "variants")
+        self.widths = tuple(sorted(widths))
+        self.formats = supported_formats(formats)
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.widths and self.formats)
+
+    def submit(self, filename):
+        """Queue variant generation for an image; returns immediately"""
+        if not self.enabled:
+            return
+        try:
+            with self._lock:
+                if self._executor is None:
+                    # Spawn rather than fork: forking a process full of threads can deadlock the child
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+                executor = self._executor
+            future = executor.submit(make_variants, self.directory, filename, self.variant_directory, self.widths, self.formats)
+        except Exception as e:
+            # Variants are a nice-to-have; the full-size image still works
+            print("Image variants failed:", e)
+            if isinstance(e, BrokenProcessPool):
+                self._discard(executor)
+            return
+        future.add_done_callback(lambda future: self._report_failure(executor, future))
+
+    def _report_failure(self, executor, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        print("Image variants failed:", future.exception())
+        if isinstance(future.exception(), BrokenProcessPool):
+            self._discard(executor)
+
+    def _discard(self, executor):
+        # A worker died (out of memory, or crashed on a bad image) and took
+        # the pool with it; the next image starts a new one
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def remove(self, filename):
+        """Delete the variants of an image that is no longer stored"""
+        for width in self.widths:
+            for fmt in self.formats:
+                try:
+                    os.remove(os.path.join(self.variant_directory, variant_name(filename, width, fmt)))
+                except OSError:
+                    pass
+
+    def sources(self, url, full_width):
+        """List (MIME type, srcset) pairs for an image URL under /images/, best format first"""
+        if not self.enabled or not url or not url.startswith("/images/") or url.startswith("/images/variants/"):
+            return []
+        filename = url.rsplit("/", 1)[1]
+        sources = []
+        for fmt in self.formats:
+            srcset = [f"/images/variants/{variant_name(filename, width, fmt)} {width}w" for width in self.widths if width < full_width]
+            srcset.append(f"{url} {full_width}w")
+            sources.append((FORMATS[fmt][1], ", ".join(srcset)))
+        return sources
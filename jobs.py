@@ -0,0 +1,85 @@
+# jobs.py
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Run story generation in background workers and keep the results for a while.
+
+    At most ``max_workers`` jobs run at once and at most ``max_pending`` wait
+    behind them; finished jobs are forgotten ``ttl`` seconds after they end.
+    """
+
+    def __init__(self, max_workers=4, max_pending=100, ttl=3600):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._jobs = {}  # job id -> job dict
+        self._finished = OrderedDict()  # job id -> finished time, oldest first
+        self._active = 0  # queued or running
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` and return the new job's id"""
+        with self._lock:
+            self._expire()
+            if self._active >= self.max_workers + self.max_pending:
+                raise QueueFull("Too many stories are being generated, please try again later.")
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="story-job")
+            job_id = secrets.token_urlsafe(12)
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "created_at": time.time(),
+                "finished_at": None,
+                "result": None,
+                "error": None
+            }
+            self._active += 1
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def get(self, job_id):
+        """Return a copy of the job, or None if it is unknown or expired"""
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status="running")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._update(job_id, status="failed", error=str(e), finished_at=time.time())
+        else:
+            self._update(job_id, status="done", result=result, finished_at=time.time())
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+                if fields.get("finished_at"):
+                    self._finished[job_id] = fields["finished_at"]
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if finished_at > cutoff:
+                break
+            del self._finished[job_id]
+            del self._jobs[job_id]
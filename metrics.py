@@ -0,0 +1,216 @@
+# metrics.py
+import bisect
+import threading
+import time
+
+# Default histogram buckets, in seconds: from template fills (microseconds) to slow image calls
+SECONDS_BUCKETS = (0.00001, 0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, **labels):
+        """The series for one set of label values; keep it around on hot paths"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _series(self):
+        if not self.labelnames:
+            return [((), self.labels())]
+        return sorted(self._children.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._series():
+            lines += child.render(self.name, self.labelnames, values)
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {self.value:g}"]
+
+
+class Counter(_Metric):
+    """A count that only goes up"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1, **labels):
+        self.labels(**labels).inc(amount)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, like calls in flight"""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1, **labels):
+        self.labels(**labels).inc(amount)
+
+    def dec(self, amount=1, **labels):
+        self.labels(**labels).dec(amount)
+
+    def set(self, value, **labels):
+        self.labels(**labels).set(value)
+
+
+class GaugeFunction(_Metric):
+    """A gauge (or counter) read from ``fn()`` when metrics are collected.
+
+    ``fn`` returns a number, or a dict of label value -> number when the
+    metric has one label.
+    """
+
+    def __init__(self, name, documentation, fn, labelnames=(), kind="gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.fn()
+        except Exception as e:
+            print("Metric collection failed:", self.name, e)
+            return lines
+        if isinstance(value, dict):
+            for label, number in sorted(value.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, (label,))} {number:g}")
+        else:
+            lines.append(f"{self.name} {value:g}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class _HistogramValues:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Observe how long a ``with`` block takes"""
+        return _Timer(self)
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, [('le', le)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {total:g}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Counts observations (usually durations in seconds) into buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValues(self.buckets)
+
+    def observe(self, value, **labels):
+        self.labels(**labels).observe(value)
+
+    def time(self, **labels):
+        return self.labels(**labels).time()
+
+
+def render():
+    """All metrics in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = []
+
+# Story pipeline stages: keywords, template_fill, tone_transform and images (all of a story's)
+STAGE_SECONDS = Histogram("story_stage_seconds", "Time spent in each stage of making a story", ["stage"])
+
+# Image calls, as made to the image backend (retries count separately)
+IMAGE_CALL_SECONDS = Histogram("image_call_seconds", "Image backend call latency", ["outcome"])
+IMAGE_CALLS = Counter("image_calls_total", "Image backend calls by outcome (ok, throttled, error)", ["outcome"])
+IMAGE_CALL_ERRORS = Counter("image_call_errors_total", "Failed image backend calls by HTTP status (none for timeouts and network errors)", ["status"])
+IMAGE_CALLS_IN_FLIGHT = Gauge("image_calls_in_flight", "Image backend calls running now")
+
+STORY_CACHE_LOOKUPS = Counter("story_cache_lookups_total", "Whole-story cache lookups for seeded stories (hit, miss)", ["result"])
+
+TEMPLATE_RENDER_SECONDS = Histogram("template_render_seconds", "Page rendering time; streamed pages include waiting for their images", ["template"])
+REQUEST_SECONDS = Histogram("http_request_seconds", "Time until a response starts, by endpoint and status", ["endpoint", "status"])
@@ -0,0 +1,140 @@
+# profiling.py
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import threading
+import time
+
+from werkzeug.utils import secure_filename
+
+
+class RequestProfiler:
+    """WSGI middleware running chosen requests under cProfile.
+
+    A request is profiled when it carries ``header`` set to ``token``, or at
+    random for ``sample_rate`` of all requests. The profile covers the whole
+    response, streamed bodies included, but only the request's own thread:
+    work handed to the image and export pools shows up as time spent waiting.
+    Profiles are saved as pstats files, and only the most recent ``max_files``
+    are kept. Requests that aren't picked cost a dictionary lookup.
+    """
+
+    def __init__(self, app, directory, token="", sample_rate=0.0, header="X-Profile", max_files=50):
+        self.app = app
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.environ_key = "HTTP_" + header.upper().replace("-", "_")
+        self.max_files = max_files
+        # One profile at a time; newer Pythons allow only one profiler per process
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        asked = environ.get(self.environ_key)
+        if asked is not None and self.token and hmac.compare_digest(asked.encode("utf-8"), self.token.encode("utf-8")):
+            return self._profiled(environ, start_response)
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self._profiled(environ, start_response)
+        return self.app(environ, start_response)
+
+    def _profiled(self, environ, start_response):
+        if not self._busy.acquire(blocking=False):
+            # Another request is being profiled; serve this one as usual
+            body = self.app(environ, start_response)
+            try:
+                yield from body
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+            return
+
+        profile = cProfile.Profile()
+        statuses = []
+
+        def recording_start_response(status, headers, exc_info=None):
+            statuses.append(status)
+            return start_response(status, headers, exc_info)
+
+        body = None
+        started = time.perf_counter()
+        try:
+            try:
+                profile.enable()
+            except ValueError as e:  # Some other profiler or debugger is running
+                print("Could not profile request:", e)
+                profile = None
+            body = self.app(environ, recording_start_response)
+            yield from body
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+            if profile is not None:
+                profile.disable()
+            self._busy.release()
+            if profile is not None:
+                status = statuses[-1].split(" ", 1)[0] if statuses else "000"
+                self._save(profile, environ, status, time.perf_counter() - started)
+
+    def _save(self, profile, environ, status, seconds):
+        # Everything needed for the listing goes in the file name:
+        # <unix ms>-<status>-<ms taken>ms-<method>-<path>.pstats
+        path = secure_filename(environ.get("PATH_INFO", "").strip("/").replace("/", "_")) or "index"
+        name = f"{int(time.time() * 1000)}-{status}-{round(seconds * 1000)}ms-{environ.get('REQUEST_METHOD', 'GET')}-{path[:80]}.pstats"
+        tmp_path = os.path.join(self.directory, name + ".tmp")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(tmp_path)
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        except OSError as e:
+            print("Could not save profile:", e)
+            return
+        self._trim()
+
+    def _trim(self):
+        # Keep only the most recent profiles
+        with self._lock:
+            names = self._names()
+            for name in names[self.max_files:]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _names(self):
+        # Newest first; the names start with a timestamp of fixed width
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted((name for name in os.listdir(self.directory) if name.endswith(".pstats")), reverse=True)
+
+    def recent(self):
+        """The saved profiles, newest first"""
+        profiles = []
+        for name in self._names():
+            created, status, taken, method, path = name[:-len(".pstats")].split("-", 4)
+            profiles.append({
+                "name": name,
+                "created": int(created) / 1000,
+                "status": int(status),
+                "milliseconds": int(taken[:-2]),
+                "method": method,
+                "path": path
+            })
+        return profiles
+
+    def path(self, name):
+        """The file of a saved profile, or None"""
+        if os.path.basename(name) != name or not name.endswith(".pstats"):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def summary(self, name, sort="cumulative", limit=40):
+        """A saved profile as text, its ``limit`` most expensive functions by ``sort``"""
+        output = io.StringIO()
+        stats = pstats.Stats(self.path(name), stream=output)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return output.getvalue()
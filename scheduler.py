@@ -0,0 +1,403 @@
+# scheduler.py
+import asyncio
+import functools
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+def error_status(error):
+    """The HTTP status behind an API error, if it has one"""
+    return getattr(error, "status_code", None)
+
+
+def is_overloaded(error):
+    """True for errors that mean "slow down": 429 and 5xx responses"""
+    status = error_status(error)
+    return status == 429 or (status is not None and status >= 500)
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait before trying again, or None"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class _Task:
+    def __init__(self, tenant, fn, args, kwargs, deadline, loop=None):
+        self.tenant = tenant
+        self.future = Future()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.deadline = deadline
+        self.loop = loop  # Set for coroutine functions, which run on this loop
+        self.attempt = 0
+        self.not_before = 0.0
+        self.started = 0.0
+
+
+class _Window:
+    def __init__(self, maximum):
+        self.limit = float(maximum)  # calls allowed in flight, adjusted as we go
+        self.maximum = maximum
+        self.in_flight = 0
+        self.last_decrease = 0.0
+
+
+class _Tenant:
+    def __init__(self, burst, limit, async_limit):
+        self.queue = deque()
+        self.tokens = float(burst)
+        self.refilled = time.monotonic()
+        # Calls in threads and calls on event loops have a window each, so
+        # the async ones aren't held to the size of the thread pool
+        self.window = _Window(limit)
+        self.async_window = _Window(async_limit)
+        self.paused_until = 0.0
+
+    def window_for(self, task):
+        return self.window if task.loop is None else self.async_window
+
+    @property
+    def in_flight(self):
+        return self.window.in_flight + self.async_window.in_flight
+
+
+class RateScheduler:
+    """Runs API calls for many tenants (API keys) fairly and within their rate limits.
+
+    Each tenant has a token bucket of ``rate`` calls per second with room for
+    ``burst``, and a concurrency window that grows by one call per window of
+    successes and halves when the API answers 429 or 5xx (AIMD). Overloaded
+    calls are retried after an exponential backoff with full jitter, and a 429
+    pauses the whole tenant so its other calls don't pile on. Tenants with
+    work waiting take turns, so one busy tenant can't starve the rest.
+
+    Calls run in a pool of ``max_workers`` threads. Coroutine functions
+    submitted from an event loop run on that loop instead, up to
+    ``max_async`` of them at once, without a thread each; their per-tenant
+    window is capped at ``max_async_concurrency`` rather than
+    ``max_concurrency``.
+    """
+
+    def __init__(self, max_workers=8, rate=1.0, burst=10, max_concurrency=8, min_concurrency=1,
+                 max_retries=4, base_delay=1.0, max_delay=30.0, idle_tenants=1000, max_async=None, max_async_concurrency=None):
+        self.max_workers = max_workers
+        self.max_async = max_async or max_workers
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_async_concurrency = max_async_concurrency or max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idle_tenants = idle_tenants
+        self._tenants = {}  # tenant -> _Tenant
+        self._ready = OrderedDict()  # tenants with queued calls, in turn order
+        self._running = 0  # calls in the thread pool
+        self._running_async = 0  # calls on event loops
+        self.retries = 0  # calls retried after a 429 or 5xx, ever
+        self._cond = threading.Condition()
+        self._executor = None
+        self._dispatcher = None
+
+    def submit(self, tenant, fn, *args, deadline=None, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` for a tenant and return a future for its result.
+
+        ``deadline`` is a ``time.monotonic()`` time after which the call is
+        not retried any more. Await the future of a coroutine function with
+        ``asyncio.wrap_future``.
+        """
+        loop = asyncio.get_running_loop() if asyncio.iscoroutinefunction(fn) else None
+        task = _Task(tenant, fn, args, kwargs, deadline, loop)
+        with self._cond:
+            if self._dispatcher is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="image-call")
+                self._dispatcher = threading.Thread(target=self._dispatch, name="image-scheduler", daemon=True)
+                self._dispatcher.start()
+            state = self._tenants.get(tenant)
+            if state is None:
+                self._forget_idle()
+                state = self._tenants[tenant] = _Tenant(self.burst, self.max_concurrency, self.max_async_concurrency)
+            state.queue.append(task)
+            self._ready.setdefault(tenant, state)
+            self._cond.notify()
+        return task.future
+
+    def stats(self):
+        """Current windows, tokens and queue length of each tenant"""
+        with self._cond:
+            return {
+                tenant: {
+                    "limit": state.window.limit,
+                    "in_flight": state.window.in_flight,
+                    "async_limit": state.async_window.limit,
+                    "async_in_flight": state.async_window.in_flight,
+                    "queued": len(state.queue),
+                    "tokens": state.tokens
+                }
+                for tenant, state in self._tenants.items()
+            }
+
+    def _forget_idle(self):
+        # Drop tenants that have nothing going on, so the table stays small
+        if len(self._tenants) < self.idle_tenants:
+            return
+        for tenant, state in list(self._tenants.items()):
+            if not state.queue and not state.in_flight:
+                del self._tenants[tenant]
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                task, wait_for = self._next_task()
+                while task is None:
+                    self._cond.wait(wait_for)
+                    task, wait_for = self._next_task()
+            if task.loop is None:
+                self._executor.submit(self._run, task)
+                continue
+            try:
+                call = asyncio.run_coroutine_threadsafe(task.fn(*task.args, **task.kwargs), task.loop)
+            except RuntimeError as e:  # The loop was closed
+                self._finish(task, None, e)
+            else:
+                call.add_done_callback(functools.partial(self._finish_async, task))
+
+    def _next_task(self):
+        """Take the next call that may start now, or say how long to wait; call with the lock held"""
+        threads_free = self._running < self.max_workers
+        async_free = self._running_async < self.max_async
+        if not threads_free and not async_free:
+            return None, None
+        now = time.monotonic()
+        wait_for = None
+        for tenant, state in list(self._ready.items()):
+            # Calls whose caller gave up before they started are dropped
+            while state.queue and state.queue[0].attempt == 0 and state.queue[0].future.cancelled():
+                state.queue.popleft()
+            if not state.queue:
+                del self._ready[tenant]
+                continue
+            task = state.queue[0]
+            window = state.window_for(task)
+            if window.in_flight >= int(window.limit):
+                continue  # Woken again when one of its calls finishes
+            if not (async_free if task.loop else threads_free):
+                continue  # Likewise
+
+            state.tokens = min(self.burst, state.tokens + (now - state.refilled) * self.rate)
+            state.refilled = now
+            ready_at = max(task.not_before, state.paused_until)
+            if state.tokens < 1:
+                ready_at = max(ready_at, now + (1 - state.tokens) / self.rate)
+            if ready_at > now:
+                wait_for = ready_at - now if wait_for is None else min(wait_for, ready_at - now)
+                continue
+
+            state.queue.popleft()
+            if task.attempt == 0 and not task.future.set_running_or_notify_cancel():
+                wait_for = 0  # Cancelled just now; look at this tenant again straight away
+                continue
+            state.tokens -= 1
+            window.in_flight += 1
+            if task.loop is None:
+                self._running += 1
+            else:
+                self._running_async += 1
+            task.started = now
+            # This tenant goes to the back of the line
+            if state.queue:
+                self._ready.move_to_end(tenant)
+            else:
+                del self._ready[tenant]
+            return task, None
+        return None, wait_for
+
+    def _run(self, task):
+        try:
+            result = task.fn(*task.args, **task.kwargs)
+        except Exception as e:
+            self._finish(task, None, e)
+        else:
+            self._finish(task, result, None)
+
+    def _finish_async(self, task, call):
+        if call.cancelled():
+            self._finish(task, None, asyncio.CancelledError())
+        elif call.exception() is not None:
+            self._finish(task, None, call.exception())
+        else:
+            self._finish(task, call.result(), None)
+
+    def _finish(self, task, result, error):
+        with self._cond:
+            state = self._tenants[task.tenant]
+            window = state.window_for(task)
+            window.in_flight -= 1
+            if task.loop is None:
+                self._running -= 1
+            else:
+                self._running_async -= 1
+            retry = False
+            if error is None:
+                # Additive increase: about one more call per window of successes
+                window.limit = min(window.maximum, window.limit + 1 / window.limit)
+            elif is_overloaded(error):
+                now = time.monotonic()
+                # Multiplicative decrease, once per window: calls that were
+                # already in flight when we backed off don't cut it again
+                if task.started >= window.last_decrease:
+                    window.limit = max(self.min_concurrency, window.limit / 2)
+                    window.last_decrease = now
+                task.attempt += 1
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** task.attempt))
+                delay = max(delay, retry_after(error) or 0)
+                if error_status(error) == 429:
+                    state.paused_until = max(state.paused_until, now + delay)
+                retry = task.attempt <= self.max_retries and (task.deadline is None or now + delay < task.deadline)
+                if retry:
+                    self.retries += 1
+                    task.not_before = now + delay
+                    state.queue.appendleft(task)
+                    self._ready[task.tenant] = state
+            self._cond.notify()
+
+        if retry:
+            return
+        if error is None:
+            task.future.set_result(result)
+        else:
+            task.future.set_exception(error)
+
+
+class LatencyTracker:
+    """Remembers the durations of the last ``window`` calls"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        """The given percentile (0.95 for p95) of recent durations, or None until there are enough"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class _Timer:
+    def __init__(self, fn):
+        self.fn = fn
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerThread:
+    """Runs functions after a delay, all from one thread rather than a thread each"""
+
+    def __init__(self, name="timers"):
+        self.name = name
+        self._heap = []  # (when, sequence, _Timer)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, delay, timer):
+        """Call ``timer.fn()`` in ``delay`` seconds, unless the timer is cancelled first"""
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), timer))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, timer = heapq.heappop(self._heap)
+            if timer.cancelled:
+                continue
+            try:
+                timer.fn()
+            except Exception as e:
+                print("Timer failed:", e)
+
+
+# Starts the backup calls of every hedged call
+hedge_timers = TimerThread("hedge-timers")
+
+
+def hedge(first, start_second, delay, timers=hedge_timers):
+    """Race a second call against ``first`` if it is still running after ``delay`` seconds.
+
+    ``start_second`` starts the backup call and returns its future. The
+    returned future has the result of whichever call succeeds first, or the
+    error of the last one to fail. A call still waiting for its turn isn't
+    hedged: a duplicate would only wait in the same queue.
+    """
+    result = Future()
+    pending = [first]
+    lock = threading.Lock()
+
+    def finished(future):
+        with lock:
+            pending.remove(future)
+            if result.done():
+                return
+            if future.cancelled() or future.exception() is not None:
+                if pending:
+                    return  # The other call may still succeed
+                timer.cancel()
+                if future.cancelled():
+                    result.cancel()
+                else:
+                    result.set_exception(future.exception())
+            else:
+                timer.cancel()
+                result.set_result(future.result())
+
+    def start():
+        with lock:
+            if result.done() or not first.running():
+                return
+            second = start_second()
+            pending.append(second)
+        second.add_done_callback(finished)
+
+    def cancelled(future):
+        # The caller gave up, so drop calls that haven't started
+        if future.cancelled():
+            timer.cancel()
+            for call in list(pending):
+                call.cancel()
+
+    timer = _Timer(start)
+    first.add_done_callback(finished)
+    result.add_done_callback(cancelled)
+    if not first.done():
+        timers.schedule(delay, timer)
+    return result
@@ -0,0 +1,72 @@
+# singleflight.py
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+
+class _Flight:
+    def __init__(self, future):
+        self.future = future
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Start at most one call per key at a time.
+
+    Callers that ask for a key while its call is pending get a future for
+    the same result, or the same exception, instead of starting another.
+    Each caller gets a future of its own, so one giving up doesn't cancel
+    the call for the others; it is cancelled once every caller has.
+    """
+
+    def __init__(self):
+        self._flights = {}  # key -> _Flight
+        self._lock = threading.Lock()
+
+    def submit(self, key, start):
+        """Return a future for the key's result, calling ``start()`` for a new future if none is pending"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(start())
+            flight.waiters += 1
+        if leader:
+            # Outside the lock: a future that is done already runs this at once
+            flight.future.add_done_callback(lambda _: self._forget(key, flight))
+        result = Future()
+        flight.future.add_done_callback(lambda future: _copy_outcome(future, result))
+        result.add_done_callback(lambda _: self._cancelled(key, flight, result))
+        return result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    def _forget(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _cancelled(self, key, flight, result):
+        if not result.cancelled():
+            return
+        with self._lock:
+            flight.waiters -= 1
+            if flight.waiters:
+                return
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        # Nobody is waiting any more; drops the call if it hasn't started
+        flight.future.cancel()
+
+
+def _copy_outcome(source, target):
+    try:
+        if source.cancelled():
+            target.cancel()
+        elif source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+    except InvalidStateError:
+        pass  # The caller gave up already
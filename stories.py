@@ -0,0 +1,605 @@
+# stories.py
+import base64
+import binascii
+import random
+import re
+import time
+import zlib
+from datetime import datetime
+from functools import lru_cache
+
+from metrics import STAGE_SECONDS
+
+# Stage timings, observed once per story so the per-template hot path stays cheap
+_KEYWORDS_SECONDS = STAGE_SECONDS.labels(stage="keywords")
+_FILL_SECONDS = STAGE_SECONDS.labels(stage="template_fill")
+_TRANSFORM_SECONDS = STAGE_SECONDS.labels(stage="tone_transform")
+
+# Story templates for different genres
+STORY_TEMPLATES = {
+    "fantasy": [
+        {
+            "title": "The Enchanted {item}",
+            "scenes": [
+                {
+                    "title": "The Discovery",
+                    "text": "In the heart of the {place}, {character} stumbled upon a mysterious {item} that seemed to glow with an otherworldly light. Little did {character} know, this was no ordinary {item} - it held the key to a hidden realm that had been forgotten for centuries.",
+                    "image_prompt": "{character} discovering a glowing {item} in a {place}, fantasy style"
+                },
+                {
+                    "title": "The Gateway",
+                    "text": "As {character} touched the {item}, a shimmering portal materialized before {character}. Through the swirling mist, {character} could see a world of {fantasy_elements}. With a deep breath, {character} stepped through, leaving the familiar world behind.",
+                    "image_prompt": "A magical portal opening in a {place} with {fantasy_elements} visible through it, fantasy art"
+                },
+                {
+                    "title": "The Challenge",
+                    "text": "In this new realm, {character} encountered a {magical_creature} who explained that the {item} was actually the {important_artifact} needed to {important_task}. But first, {character} had to prove worthy by {challenge_description}.",
+                    "image_prompt": "{character} facing a {magical_creature} in a magical realm, fantasy illustration"
+                },
+                {
+                    "title": "The Triumph",
+                    "text": "After successfully {challenge_completion}, {character} used the {item} to {successful_action}, restoring balance to the magical realm. The {magical_creature} granted {character} a gift - the ability to travel between worlds whenever needed.",
+                    "image_prompt": "{character} triumphantly holding the {item} with magical energy swirling around, epic fantasy art"
+                }
+            ]
+        }
+    ],
+    "sci-fi": [
+        {
+            "title": "The {tech_device} Incident",
+            "scenes": [
+                {
+                    "title": "The Anomaly",
+                    "text": "While conducting routine experiments with the {tech_device}, {character} noticed strange readings that defied all known physics. The device was detecting {sci_fi_phenomenon} from a distant sector of space - something that should be impossible according to current scientific understanding.",
+                    "image_prompt": "{character} observing strange readings on a {tech_device} display, sci-fi style"
+                },
+                {
+                    "title": "First Contact",
+                    "text": "Following the anomalous signals, {character} and the team embarked on a journey to the source. What they found was beyond anything they could have imagined - a {alien_species} whose technology operated on principles humanity had yet to discover.",
+                    "image_prompt": "First contact with a {alien_species} in a spaceship or alien environment, science fiction art"
+                },
+                {
+                    "title": "The Revelation",
+                    "text": "The {alien_species} revealed that the {tech_device} was actually a key to preventing an impending {cosmic_threat}. They needed humanity's help because only human DNA could interface with the ancient technology designed to {solution_action}.",
+                    "image_prompt": "{alien_species} explaining a {cosmic_threat} to {character} and team, sci-fi illustration"
+                },
+                {
+                    "title": "The Solution",
+                    "text": "Working together with the {alien_species}, {character} used the modified {tech_device} to {successful_solution}, averting disaster and opening a new chapter in human-alien relations. The experience changed humanity's understanding of its place in the universe forever.",
+                    "image_prompt": "{character} operating a advanced device with alien technology to save the day, epic sci-fi art"
+                }
+                    
+            ]
+        }
+    ],
+    "mystery": [
+        {
+            "title": "The Case of the {mysterious_object}",
+            "scenes": [
+                {
+                    "title": "The Discovery",
+                    "text": "When {character} found the {mysterious_object} in the {location}, little did {character} know it would lead to the unraveling of a decades-old mystery. The object contained clues that connected to the unsolved case of the {famous_mystery}.",
+                    "image_prompt": "{character} discovering a {mysterious_object} in a {location}, mysterious atmosphere"
+                },
+                {
+                    "title": "The Investigation",
+                    "text": "Following the clues from the {mysterious_object}, {character} began investigating the {historical_location} and uncovered evidence that suggested the original investigation had missed crucial details. Witness accounts from the time period didn't match the official story.",
+                    "image_prompt": "{character} investigating clues and examining evidence in a {historical_location}, noir style"
+                },
+                {
+                    "title": "The Breakthrough",
+                    "text": "A hidden message in the {mysterious_object} led {character} to a secret {hidden_place} where the truth had been concealed all along. There, {character} found proof that {shocking_revelation}.",
+                    "image_prompt": "{character} finding hidden evidence in a secret {hidden_place}, dramatic lighting"
+                },
+                {
+                    "title": "The Resolution",
+                    "text": "With the mystery finally solved, {character} was able to bring closure to those affected by the events. The {mysterious_object} was placed in a museum as a testament to the importance of perseverance in seeking truth.",
+                    "image_prompt": "{character} presenting the solved mystery and the {mysterious_object} in a museum or public setting, satisfying resolution"
+                }
+            ]
+        }
+    ]
+}
+
+# Word banks for different categories
+WORD_BANKS = {
+    "character": ["young girl", "curious boy", "brave explorer", "retired detective", "scientist", "student", "artist", "writer"],
+    "place": ["ancient forest", "abandoned factory", "grandmother's attic", "old library", "seaside cliff", "mountain cave", "city museum"],
+    "item": ["necklace", "book", "compass", "key", "crystal", "watch", "locket", "ring"],
+    "fantasy_elements": ["floating islands", "talking animals", "enchanted trees", "magical streams", "mythical creatures"],
+    "magical_creature": ["wise dragon", "ancient tree spirit", "mischievous fairy", "noble unicorn", "helpful gnome"],
+    "important_artifact": ["Heart of the Forest", "Star Crystal", "Moon Amulet", "Sun Stone", "Key of Ages"],
+    "important_task": ["restore the fading magic", "heal the wounded land", "awaken the sleeping guardians", "banish the spreading darkness"],
+    "challenge_description": ["retrieving the lost artifact from the treacherous mountains", "solving the riddles of the ancient temple", "earning the trust of the wary forest creatures"],
+    "challenge_completion": ["retrieving the artifact", "solving the riddles", "earning their trust"],
+    "successful_action": ["channel the ancient energies", "awaken the guardians", "heal the land"],
+    "tech_device": ["quantum resonator", "tachyon scanner", "dimensional gateway", "chronal stabilizer"],
+    "sci_fi_phenomenon": ["temporal distortions", "gravitational anomalies", "energy signatures", "dimensional rifts"],
+    "alien_species": ["crystalline beings", "energy-based lifeforms", "telepathic hive mind", "shape-shifting species"],
+    "cosmic_threat": ["dimensional collapse", "time paradox", "black hole emergence", "reality unraveling"],
+    "solution_action": ["stabilize the space-time continuum", "prevent the cosmic catastrophe", "seal the dimensional breach"],
+    "successful_solution": ["redirect the destructive energy", "stabilize the anomaly", "close the rift"],
+    "mysterious_object": ["old diary", "strange device", "cryptic painting", "ancient coin", "weathered photograph"],
+    "location": ["antique shop", "family estate", "old hotel", "university archive", "beach house"],
+    "famous_mystery": ["Vanishing Heiress", "Phantom Writer", "Silent Symphony", "Missing Inventor"],
+    "historical_location": ["old mansion", "abandoned hospital", "historic theater", "former factory"],
+    "hidden_place": ["secret room", "underground tunnel", "hidden compartment", "forgotten archive"],
+    "shocking_revelation": ["the supposed victim was actually the mastermind", "there were two identical objects switched at the critical moment", "the key witness had been misleading everyone intentionally"]
+}
+
+# Art style modifiers
+ART_STYLES = {
+    "realistic": "photorealistic, detailed, realistic",
+    "cartoon": "cartoon style, vibrant colors, animated",
+    "anime": "anime style, Japanese animation, vibrant",
+    "watercolor": "watercolor painting, soft edges, artistic",
+    "digital art": "digital art, concept art, dramatic lighting",
+    "oil painting": "oil painting, classic art, textured"
+}
+
+def placeholder_image_url(prompt, art_style="realistic"):
+    """A stock picture for a prompt, used where there is no generated image"""
+    style_modifier = ART_STYLES.get(art_style, ART_STYLES["realistic"])
+    full_prompt = f"{prompt}, {style_modifier}"
+    # crc32 rather than hash() so every process picks the same picture
+    image_id = zlib.crc32(full_prompt.encode("utf-8")) % 1000
+    return f"https://picsum.photos/512/512?random={image_id}"
+
+class ChoiceRecorder:
+    """Makes random choices like ``random.choice`` and remembers the index of each pick"""
+
+    def __init__(self, rng=random):
+        self.rng = rng
+        self.picks = []
+
+    def choice(self, seq):
+        index = self.rng.randrange(len(seq))
+        self.picks.append(index)
+        return seq[index]
+
+
+class ChoiceReplayer:
+    """Replays the picks of a ChoiceRecorder, in the same order"""
+
+    def __init__(self, picks):
+        self._picks = iter(picks)
+
+    def choice(self, seq):
+        return seq[next(self._picks)]
+
+
+def story_rng(seed=None):
+    """Random source for one story: seeded stories come out the same every time"""
+    return random.Random(seed) if seed is not None else random
+
+def fill_story(template, keywords, genre, tone, audience, rng=random):
+    """Fill in the title and scenes of a story template"""
+    seconds = [0.0, 0.0]  # filling in words, tone transforms
+
+    def fill(text):
+        # fill_template, timing its two steps
+        started = time.perf_counter()
+        text = fill_words(text, keywords, rng)
+        filled = time.perf_counter()
+        text = transform_text(text, tone, audience, rng)
+        seconds[0] += filled - started
+        seconds[1] += time.perf_counter() - filled
+        return text
+
+    story = {
+        "title": fill(template["title"]),
+        "scenes": []
+    }
+
+    for scene_template in template["scenes"]:
+        filled_scene = {
+            "title": fill(scene_template["title"]),
+            "text": fill(scene_template["text"]),
+            "image_prompt": fill(scene_template["image_prompt"])
+        }
+        story["scenes"].append(filled_scene)
+
+    _FILL_SECONDS.observe(seconds[0])
+    _TRANSFORM_SECONDS.observe(seconds[1])
+    return story
+
+def build_story(idea, genre, tone, audience, art_style, rng=random):
+    """Fill in the story text, without generating any images"""
+    # Select appropriate template based on genre
+    if genre not in STORY_TEMPLATES:
+        genre = "fantasy"
+    # Every pick from here on is recorded so the story can be rebuilt from its token
+    picks = ChoiceRecorder(rng)
+    template = picks.choice(STORY_TEMPLATES[genre])
+
+    # Extract keywords from the idea
+    started = time.perf_counter()
+    keywords = extract_keywords(idea, rng)
+    _KEYWORDS_SECONDS.observe(time.perf_counter() - started)
+
+    # Fill in the template with appropriate words
+    story = fill_story(template, keywords, genre, tone, audience, picks)
+    story.update({
+        "idea": idea,
+        "art_style": art_style,
+        "token": encode_story(genre, tone, audience, art_style, keywords, picks.picks)
+    })
+    if rng is random:
+        # Seeded stories leave out the time, so a repeat comes out byte for byte the same
+        story["generated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return story
+
+# Words in a story idea that pick the character, in priority order
+CHARACTER_HINTS = {
+    "girl": "young girl",
+    "boy": "curious boy",
+    "man": "old man",
+    "woman": "wise woman",
+    "robot": "lonely robot",
+    "detective": "retired detective"
+}
+
+# Word banks whose entries can be picked straight out of a story idea
+KEYWORD_CATEGORIES = ("character", "item", "place")
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+_keyword_index = None
+_keyword_index_version = None
+
+def _vocabulary_version():
+    # Cheap fingerprint of the vocabularies: notices banks being replaced or
+    # growing/shrinking; call rebuild_keyword_index() after in-place edits
+    return (id(CHARACTER_HINTS), len(CHARACTER_HINTS)) + tuple(
+        (id(WORD_BANKS.get(category)), len(WORD_BANKS.get(category, ()))) for category in KEYWORD_CATEGORIES
+    )
+
+def rebuild_keyword_index():
+    """Build a token trie over the keyword vocabularies.
+
+    Each phrase is stored as a path of lowercase tokens; the node at the end
+    lists (category, priority, value) for every vocabulary entry spelled
+    that way. Lower priorities win, following the order of the vocabularies.
+    """
+    global _keyword_index, _keyword_index_version
+    phrases = [("character", hint, value) for hint, value in CHARACTER_HINTS.items()]
+    for category in KEYWORD_CATEGORIES:
+        phrases += [(category, entry, entry) for entry in WORD_BANKS.get(category, ())]
+
+    trie = {}
+    max_tokens = 0
+    priorities = {}
+    for category, phrase, value in phrases:
+        tokens = TOKEN_PATTERN.findall(phrase.lower())
+        if not tokens:
+            continue
+        node = trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        priority = priorities[category] = priorities.get(category, -1) + 1
+        node.setdefault("", []).append((category, priority, value))
+        max_tokens = max(max_tokens, len(tokens))
+
+    _keyword_index = (trie, max_tokens)
+    _keyword_index_version = _vocabulary_version()
+    return _keyword_index
+
+def keyword_index():
+    """Return the keyword index, rebuilding it only if the vocabularies changed"""
+    if _keyword_index is None or _keyword_index_version != _vocabulary_version():
+        return rebuild_keyword_index()
+    return _keyword_index
+
+def extract_keywords(idea, rng=random):
+    """Extract potential keywords from the story idea"""
+    keywords = {
+        "character": rng.choice(WORD_BANKS["character"]),
+        "item": rng.choice(WORD_BANKS["item"]),
+        "place": rng.choice(WORD_BANKS["place"])
+    }
+    # Walk the idea's words once, matching whole words and phrases against
+    # the index and keeping the highest priority match for each category
+    trie, max_tokens = keyword_index()
+    tokens = TOKEN_PATTERN.findall(idea.lower())
+    best = {}
+    for start in range(len(tokens)):
+        node = trie
+        for token in tokens[start:start + max_tokens]:
+            node = node.get(token)
+            if node is None:
+                break
+            for category, priority, value in node.get("", ()):
+                if category not in best or priority < best[category][0]:
+                    best[category] = (priority, value)
+    for category, (_, value) in best.items():
+        keywords[category] = value
+    return keywords
+
+# Templates are split once into literal text and placeholder names, e.g.
+# "The Enchanted {item}" -> ["The Enchanted ", "item", ""]: even positions are
+# literals, odd positions are placeholders
+PLACEHOLDER_PATTERN = re.compile(r"\{([^{}]*)\}")
+
+@lru_cache(maxsize=1024)
+def compile_template(template):
+    """Split a template into alternating literal text and placeholder names"""
+    return tuple(PLACEHOLDER_PATTERN.split(template))
+
+def fill_template(template, keywords, genre, tone, audience, rng=random):
+    """Fill in a template with appropriate words"""
+    # Adjust tone and audience in a single pass
+    return transform_text(fill_words(template, keywords, rng), tone, audience, rng)
+
+def fill_words(template, keywords, rng=random):
+    """Replace a template's placeholders with keywords and word bank picks"""
+    parts = compile_template(template)
+    if len(parts) == 1:
+        return template
+    # A placeholder gets one word however many times it appears; known
+    # keywords win, other placeholders draw from the word bank in order of
+    # first appearance, and unknown ones are dropped
+    words = {}
+    pieces = list(parts)
+    for i in range(1, len(parts), 2):
+        placeholder = parts[i]
+        word = words.get(placeholder)
+        if word is None:
+            if placeholder in keywords:
+                word = keywords[placeholder]
+            elif placeholder in WORD_BANKS:
+                word = rng.choice(WORD_BANKS[placeholder])
+            else:
+                word = ""
+            words[placeholder] = word
+        pieces[i] = word
+    return "".join(pieces)
+
+# Stands in for a replacement picked at random from the tone's word list,
+# once per call, so every match in one text gets the same word
+RANDOM_WORD = None
+
+# Word swaps for each tone: (words to pick from at random, {original: replacement})
+TONES = {
+    "dark": (
+        ["sinister", "foreboding", "ominous", "shadowy", "eerie", "chilling"],
+        {
+            "mysterious": RANDOM_WORD,
+            "strange": "ominous",
+            "interesting": "disturbing",
+            "beautiful": "macabre"
+        }
+    ),
+    "humorous": (
+        ["hilarious", "comical", "absurd", "ridiculous", "ludicrous"],
+        {
+            "strange": RANDOM_WORD,
+            "interesting": "hilarious",
+            "mysterious": "absurd",
+            "serious": "comical"
+        }
+    ),
+    "epic": (
+        ["legendary", "monumental", "colossal", "astounding", "breathtaking"],
+        {
+            "great": RANDOM_WORD,
+            "big": "colossal",
+            "important": "monumental",
+            "interesting": "astounding"
+        }
+    ),
+    "mysterious": (
+        ["enigmatic", "cryptic", "perplexing", "inscrutable", "puzzling"],
+        {
+            "mysterious": RANDOM_WORD,
+            "strange": "enigmatic",
+            "interesting": "perplexing",
+            "secret": "inscrutable"
+        }
+    )
+}
+
+# Word swaps for each audience, applied after the tone
+AUDIENCES = {
+    "kids": {
+        "discovered": "found",
+        "encountered": "met",
+        "investigating": "looking into",
+        "ancient": "very old",
+        "mysterious": "strange",
+        "artifact": "special object",
+        "revelation": "big surprise",
+        "resolution": "ending",
+        "challenge": "test",
+        "triumph": "happy ending"
+    }
+}
+
+def _trie_pattern(words):
+    """Build a regex matching any of the words, shaped as a trie.
+
+    Unlike a flat alternation, matching at each position only follows one
+    branch per character, so the cost doesn't grow with the number of words.
+    Optional tails are greedy, so the longest word wins.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            pattern = "(?:" + pattern + ")?"
+        return pattern
+
+    return build(trie)
+
+def _replace_all(text, replacements):
+    # Used at compile time only, to push tone words through the audience swaps
+    for original, replacement in replacements.items():
+        text = text.replace(original, replacement)
+    return text
+
+@lru_cache(maxsize=None)
+def compile_transform(tone, audience):
+    """Combine the swaps for a tone and an audience into one matcher.
+
+    Returns (pattern, replacements, random words) where the replacements
+    and random words already have the audience swaps applied, or None when
+    there is nothing to change.
+    """
+    random_words, tone_replacements = TONES.get(tone, ((), {}))
+    audience_replacements = AUDIENCES.get(audience, {})
+    # The tone goes first, so its words win over the audience's
+    replacements = dict(audience_replacements)
+    for original, replacement in tone_replacements.items():
+        if replacement is not RANDOM_WORD:
+            replacement = _replace_all(replacement, audience_replacements)
+        replacements[original] = replacement
+    if not replacements:
+        return None
+    random_words = tuple(_replace_all(word, audience_replacements) for word in random_words)
+    return re.compile(_trie_pattern(replacements)), replacements, random_words
+
+def known_option(value, options):
+    """``value`` if it is one of ``options``, otherwise None (no adjustments)"""
+    return value if isinstance(value, str) and value in options else None
+
+def transform_text(text, tone, audience, rng=random):
+    """Apply the tone and audience word swaps to text in one pass"""
+    # Unknown values all share one cache entry, so requests can't grow the cache
+    compiled = compile_transform(known_option(tone, TONES), known_option(audience, AUDIENCES))
+    if compiled is None:
+        return text
+    pattern, replacements, random_words = compiled
+    random_word = rng.choice(random_words) if random_words else None
+
+    def replace(match):
+        replacement = replacements[match.group()]
+        return random_word if replacement is RANDOM_WORD else replacement
+
+    return pattern.sub(replace, text)
+
+def make_darker(text):
+    """Make the text darker in tone"""
+    return transform_text(text, "dark", None)
+
+def make_funnier(text):
+    """Make the text more humorous"""
+    return transform_text(text, "humorous", None)
+
+def make_epic(text):
+    """Make the text more epic"""
+    return transform_text(text, "epic", None)
+
+def make_mysterious(text):
+    """Make the text more mysterious"""
+    return transform_text(text, "mysterious", None)
+
+def simplify_language(text):
+    """Simplify language for children"""
+    return transform_text(text, None, "kids")
+
+# Story tokens
+#
+# A story's text is fully determined by its genre, tone, audience and
+# keywords plus the index of every random pick made while filling it in,
+# starting with the template. A token packs those small integers as varints
+# into URL-safe base64, e.g. "AQAAAAIGBAQAAgIEBAMAAQACBA", so a story can be
+# shared, stored or used as a cache key in a few dozen characters and its
+# text rebuilt with decode_story().
+
+TOKEN_VERSION = 1
+
+def keyword_vocabulary(category):
+    """Every value extract_keywords can give a category, in a stable order"""
+    vocabulary = list(WORD_BANKS[category])
+    if category == "character":
+        vocabulary += [value for value in CHARACTER_HINTS.values() if value not in vocabulary]
+    return vocabulary
+
+def _encode_varints(numbers):
+    data = bytearray()
+    for number in numbers:
+        while number >= 0x80:
+            data.append((number & 0x7F) | 0x80)
+            number >>= 7
+        data.append(number)
+    return base64.urlsafe_b64encode(bytes(data)).rstrip(b"=").decode("ascii")
+
+def _decode_varints(token):
+    data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    numbers = []
+    number = shift = 0
+    for byte in data:
+        number |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            numbers.append(number)
+            number = shift = 0
+    return numbers
+
+def encode_story(genre, tone, audience, art_style, keywords, picks):
+    """Pack a story's choices into a short token, or None if they can't be packed"""
+    try:
+        header = [
+            TOKEN_VERSION,
+            list(STORY_TEMPLATES).index(genre),
+            # 0 stands for "no tone/audience adjustments"
+            list(TONES).index(tone) + 1 if known_option(tone, TONES) else 0,
+            list(AUDIENCES).index(audience) + 1 if known_option(audience, AUDIENCES) else 0,
+            list(ART_STYLES).index(art_style)
+        ]
+        header += [keyword_vocabulary(category).index(keywords[category]) for category in KEYWORD_CATEGORIES]
+    except ValueError:
+        # Free-form art styles or keywords have no index
+        return None
+    return _encode_varints(header + list(picks))
+
+def decode_story(token, idea=""):
+    """Rebuild the text of a story from its token.
+
+    Raises ValueError if the token is malformed or was made with different
+    story tables.
+    """
+    try:
+        numbers = _decode_varints(token)
+        version, genre_index, tone_index, audience_index, art_style_index = numbers[:5]
+        if version != TOKEN_VERSION:
+            raise ValueError(f"Unsupported story token version {version}")
+        genre = list(STORY_TEMPLATES)[genre_index]
+        tone = list(TONES)[tone_index - 1] if tone_index else None
+        audience = list(AUDIENCES)[audience_index - 1] if audience_index else None
+        art_style = list(ART_STYLES)[art_style_index]
+        keyword_indices = numbers[5:5 + len(KEYWORD_CATEGORIES)]
+        if len(keyword_indices) != len(KEYWORD_CATEGORIES):
+            raise ValueError("Story token is too short")
+        keywords = {
+            category: keyword_vocabulary(category)[index]
+            for category, index in zip(KEYWORD_CATEGORIES, keyword_indices)
+        }
+        picks = ChoiceReplayer(numbers[5 + len(KEYWORD_CATEGORIES):])
+        template = picks.choice(STORY_TEMPLATES[genre])
+        story = fill_story(template, keywords, genre, tone, audience, picks)
+    except (ValueError, IndexError, StopIteration, binascii.Error) as e:
+        raise ValueError(f"Invalid story token: {token}") from e
+    story.update({"idea": idea, "art_style": art_style, "token": token})
+    return story
+
+def compile_all_templates():
+    """Compile every story template, tone transform and the keyword index up front so requests never have to"""
+    for templates in STORY_TEMPLATES.values():
+        for template in templates:
+            compile_template(template["title"])
+            for scene in template["scenes"]:
+                for field in ("title", "text", "image_prompt"):
+                    compile_template(scene[field])
+    for tone in [None, *TONES]:
+        for audience in [None, *AUDIENCES]:
+            compile_transform(tone, audience)
+    keyword_index()
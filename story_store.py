@@ -0,0 +1,122 @@
+# story_store.py
+import itertools
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def new_story_id():
+    return secrets.token_urlsafe(9)
+
+
+class MemoryStoryStore:
+    """Keeps the most recently used stories in this process"""
+
+    def __init__(self, max_entries=1000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._stories = OrderedDict()  # story id -> (story, expires_at)
+        self._lock = threading.Lock()
+
+    def put(self, story_id, story):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._stories[story_id] = (story, expires_at)
+            self._stories.move_to_end(story_id)
+            while len(self._stories) > self.max_entries:
+                self._stories.popitem(last=False)
+
+    def get(self, story_id):
+        with self._lock:
+            entry = self._stories.get(story_id)
+            if entry is None:
+                return None
+            story, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._stories[story_id]
+                return None
+            self._stories.move_to_end(story_id)
+            return story
+
+
+class SQLiteStoryStore:
+    """Keeps stories in a SQLite file, shared by every worker on the machine.
+
+    Expired stories are deleted every ``purge_every`` puts, so the file
+    doesn't keep growing.
+    """
+
+    def __init__(self, path, ttl=None, purge_every=100):
+        self.path = path
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._puts = itertools.count(1)
+        self._local = threading.local()
+        # Don't keep this connection: the store may be made in a process that
+        # forks its workers later, and a connection must not cross a fork
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:
+                db.execute("CREATE TABLE IF NOT EXISTS stories (id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL)")
+                db.execute("CREATE INDEX IF NOT EXISTS stories_expires_at ON stories (expires_at)")
+        finally:
+            db.close()
+
+    def _connect(self):
+        # SQLite connections can't be shared between threads, so keep one per thread
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def put(self, story_id, story):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO stories (id, data, expires_at) VALUES (?, ?, ?)",
+                (story_id, json.dumps(story), expires_at)
+            )
+            if self.ttl and next(self._puts) % self.purge_every == 0:
+                db.execute("DELETE FROM stories WHERE expires_at < ?", (time.time(),))
+
+    def get(self, story_id):
+        row = self._connect().execute(
+            "SELECT data FROM stories WHERE id = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (story_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+class RedisStoryStore:
+    """Keeps stories in Redis, or any server that speaks its protocol"""
+
+    def __init__(self, url, ttl=None):
+        import redis  # Only needed when this backend is configured
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+
+    def put(self, story_id, story):
+        self._redis.set(f"story:{story_id}", json.dumps(story), ex=self.ttl or None)
+
+    def get(self, story_id):
+        data = self._redis.get(f"story:{story_id}")
+        return json.loads(data) if data else None
+
+
+def open_story_store(url, max_entries=1000, ttl=None):
+    """Create the story store named by a URL.
+
+    "memory" keeps stories in this process, "sqlite:///path/to/file.db"
+    uses a SQLite file and "redis://host:port/db" uses a Redis server.
+    """
+    if url == "memory":
+        return MemoryStoryStore(max_entries=max_entries, ttl=ttl)
+    if url.startswith("sqlite:///"):
+        return SQLiteStoryStore(url[len("sqlite:///"):], ttl=ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStoryStore(url, ttl=ttl)
+    raise ValueError(f"Unknown story store: {url}")
@@ -0,0 +1,55 @@
+# tests/test_image_cache.py
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from image_cache import ImageCache
+
+
+def png(fill, size=1000):
+    return b"\x89PNG" + bytes([fill]) * (size - 4)
+
+
+class SharedDirectoryTest(unittest.TestCase):
+    """Two caches on one directory, as in two gunicorn workers"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.first = ImageCache(self.directory, max_disk_bytes=3000, rescan_interval=0)
+        self.second = ImageCache(self.directory, max_disk_bytes=3000, rescan_interval=0)
+        # Both have read the directory before anything is stored
+        self.first.get("none")
+        self.second.get("none")
+
+    def test_finds_images_stored_by_the_other(self):
+        url = self.first.put("a", png(1))
+        self.assertEqual(self.second.get("a"), url)
+
+    def test_eviction_counts_both_caches_files(self):
+        for index, key in enumerate("abcd"):
+            (self.first if index % 2 else self.second).put(key, png(index))
+            time.sleep(0.01)
+        sizes = [os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory)]
+        self.assertLessEqual(sum(sizes), 3000)
+
+    def test_does_not_serve_a_file_the_other_evicted(self):
+        self.first.put("a", png(1))
+        self.assertIsNotNone(self.second.get("a"))  # Now in the second's memory tier
+        for index, key in enumerate("bcd"):
+            self.first.put(key, png(index + 2))
+            time.sleep(0.01)
+        self.assertIsNone(self.second.get("a"))
+
+    def test_newer_copy_replaces_an_older_one(self):
+        old_url = self.first.put("a", png(1))
+        self.assertEqual(self.second.get("a"), old_url)
+        new_url = self.first.put("a", png(2))
+        self.assertNotEqual(new_url, old_url)
+        self.assertEqual(self.second.get("a"), new_url)
+
+
+if __name__ == "__main__":
+    unittest.main()
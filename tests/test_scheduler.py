@@ -0,0 +1,181 @@
+# tests/test_scheduler.py
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+
+from scheduler import RateScheduler, hedge
+
+
+class APIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+
+
+class Gate:
+    """A call that blocks until released, counting how many run at once"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.running = 0
+        self.most_running = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, value):
+        with self._lock:
+            self.calls += 1
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        try:
+            self.release.wait(5)
+        finally:
+            with self._lock:
+                self.running -= 1
+        return value
+
+
+class RateSchedulerTest(unittest.TestCase):
+    def scheduler(self, **options):
+        options = dict(dict(max_workers=8, rate=1000, burst=1000, max_concurrency=8, base_delay=0.01, max_delay=0.05), **options)
+        return RateScheduler(**options)
+
+    def test_returns_results(self):
+        scheduler = self.scheduler()
+        futures = [scheduler.submit("key", pow, 2, n) for n in range(5)]
+        self.assertEqual([future.result(5) for future in futures], [1, 2, 4, 8, 16])
+
+    def test_window_limits_calls_in_flight_per_tenant(self):
+        scheduler = self.scheduler(max_concurrency=2)
+        gate = Gate()
+        futures = [scheduler.submit("key", gate, n) for n in range(6)]
+        time.sleep(0.2)
+        self.assertEqual(gate.running, 2)
+        self.assertEqual(scheduler.stats()["key"]["queued"], 4)
+        gate.release.set()
+        self.assertEqual([future.result(5) for future in futures], list(range(6)))
+        self.assertEqual(gate.most_running, 2)
+
+    def test_tenants_do_not_share_a_window(self):
+        scheduler = self.scheduler(max_concurrency=1)
+        gate = Gate()
+        futures = [scheduler.submit(tenant, gate, tenant) for tenant in ("a", "a", "b")]
+        time.sleep(0.2)
+        self.assertEqual(gate.running, 2)
+        gate.release.set()
+        self.assertEqual([future.result(5) for future in futures], ["a", "a", "b"])
+
+    def test_rate_limits_calls(self):
+        scheduler = self.scheduler(rate=20, burst=1)
+        started = time.monotonic()
+        for future in [scheduler.submit("key", time.monotonic) for _ in range(4)]:
+            future.result(5)
+        # One call from the burst, then one every 1/20 s
+        self.assertGreaterEqual(time.monotonic() - started, 0.14)
+
+    def test_retries_throttled_calls_and_halves_the_window(self):
+        scheduler = self.scheduler()
+        attempts = []
+
+        def flaky():
+            attempts.append(time.monotonic())
+            if len(attempts) < 3:
+                raise APIError(429)
+            return "ok"
+
+        self.assertEqual(scheduler.submit("key", flaky).result(5), "ok")
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(scheduler.retries, 2)
+        self.assertLess(scheduler.stats()["key"]["limit"], 8)
+
+    def test_gives_up_after_max_retries(self):
+        scheduler = self.scheduler(max_retries=1)
+        calls = []
+
+        def failing():
+            calls.append(1)
+            raise APIError(503)
+
+        with self.assertRaises(APIError):
+            scheduler.submit("key", failing).result(5)
+        self.assertEqual(len(calls), 2)
+
+    def test_other_errors_are_not_retried(self):
+        scheduler = self.scheduler()
+        calls = []
+
+        def failing():
+            calls.append(1)
+            raise APIError(400)
+
+        with self.assertRaises(APIError):
+            scheduler.submit("key", failing).result(5)
+        self.assertEqual(len(calls), 1)
+
+    def test_cancelled_calls_do_not_run(self):
+        scheduler = self.scheduler(max_concurrency=1)
+        gate = Gate()
+        first = scheduler.submit("key", gate, 1)
+        second = scheduler.submit("key", gate, 2)
+        time.sleep(0.1)
+        self.assertTrue(second.cancel())
+        gate.release.set()
+        self.assertEqual(first.result(5), 1)
+        time.sleep(0.1)
+        self.assertEqual(gate.calls, 1)
+
+    def test_coroutines_run_on_their_loop_with_their_own_window(self):
+        scheduler = self.scheduler(max_workers=1, max_concurrency=1, max_async=50, max_async_concurrency=50)
+        running = []
+
+        async def call(n):
+            running.append(n)
+            await asyncio.sleep(0.1)
+            return n, len(running)
+
+        async def main():
+            futures = [asyncio.wrap_future(scheduler.submit("key", call, n)) for n in range(20)]
+            return await asyncio.gather(*futures)
+
+        results = asyncio.run(main())
+        self.assertEqual([n for n, _ in results], list(range(20)))
+        # All 20 were running at once, not one at a time as the thread window allows
+        self.assertEqual(max(count for _, count in results), 20)
+
+
+class HedgeTest(unittest.TestCase):
+    def test_backup_wins_when_the_first_call_is_slow(self):
+        first = Future()
+        first.set_running_or_notify_cancel()
+        backup = Future()
+        result = hedge(first, lambda: backup, 0.05)
+        time.sleep(0.15)
+        backup.set_result("backup")
+        self.assertEqual(result.result(1), "backup")
+
+    def test_no_backup_when_the_first_call_is_quick(self):
+        first = Future()
+        first.set_running_or_notify_cancel()
+        backups = []
+        result = hedge(first, lambda: backups.append(1) or Future(), 0.05)
+        first.set_result("first")
+        time.sleep(0.15)
+        self.assertEqual(result.result(1), "first")
+        self.assertEqual(backups, [])
+
+    def test_hedges_share_one_timer_thread(self):
+        hedge(Future(), Future, 10)  # Starts the timer thread
+        threads = threading.active_count()
+        calls = [Future() for _ in range(50)]
+        for call in calls:
+            call.set_running_or_notify_cancel()
+            hedge(call, Future, 10)
+        self.assertEqual(threading.active_count(), threads)
+        for call in calls:
+            call.set_result(None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# tests/test_singleflight.py
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+
+from scheduler import RateScheduler
+from singleflight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    def test_callers_share_one_call(self):
+        flights = SingleFlight()
+        shared = Future()
+        starts = []
+
+        def start():
+            starts.append(1)
+            return shared
+
+        futures = [flights.submit("key", start) for _ in range(5)]
+        self.assertEqual(flights.in_flight(), 1)
+        shared.set_result("url")
+        self.assertEqual([future.result(1) for future in futures], ["url"] * 5)
+        self.assertEqual(len(starts), 1)
+        self.assertEqual(flights.in_flight(), 0)
+
+    def test_callers_share_the_exception(self):
+        flights = SingleFlight()
+        shared = Future()
+        futures = [flights.submit("key", lambda: shared) for _ in range(3)]
+        shared.set_exception(ValueError("boom"))
+        for future in futures:
+            with self.assertRaises(ValueError):
+                future.result(1)
+
+    def test_a_finished_call_is_not_reused(self):
+        flights = SingleFlight()
+        first = Future()
+        first.set_result(1)
+        second = Future()
+        second.set_result(2)
+        self.assertEqual(flights.submit("key", lambda: first).result(1), 1)
+        self.assertEqual(flights.submit("key", lambda: second).result(1), 2)
+
+    def test_keys_are_separate(self):
+        flights = SingleFlight()
+        calls = {"a": Future(), "b": Future()}
+        a = flights.submit("a", lambda: calls["a"])
+        b = flights.submit("b", lambda: calls["b"])
+        calls["b"].set_result("b")
+        self.assertEqual(b.result(1), "b")
+        self.assertFalse(a.done())
+
+    def test_call_is_cancelled_only_when_every_caller_gives_up(self):
+        flights = SingleFlight()
+        shared = Future()
+        first = flights.submit("key", lambda: shared)
+        second = flights.submit("key", lambda: shared)
+        first.cancel()
+        self.assertFalse(shared.cancelled())
+        second.cancel()
+        self.assertTrue(shared.cancelled())
+        self.assertEqual(flights.in_flight(), 0)
+
+    def test_followers_take_no_scheduler_slot(self):
+        scheduler = RateScheduler(max_workers=8, rate=1000, burst=10, max_concurrency=8)
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return "url"
+
+        futures = [flights.submit("key", lambda: scheduler.submit("tenant", fetch)) for _ in range(8)]
+        time.sleep(0.1)
+        self.assertEqual(scheduler.stats()["tenant"]["in_flight"], 1)
+        self.assertGreaterEqual(scheduler.stats()["tenant"]["tokens"], 9 - 1e-6)
+        release.set()
+        self.assertEqual([future.result(5) for future in futures], ["url"] * 8)
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+# tests/test_story_store.py
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from story_store import SQLiteStoryStore
+
+
+class SQLiteStoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "stories.db")
+
+    def rows(self):
+        with sqlite3.connect(self.path) as db:
+            return db.execute("SELECT COUNT(*) FROM stories").fetchone()[0]
+
+    def test_round_trip(self):
+        store = SQLiteStoryStore(self.path, ttl=60)
+        store.put("a", {"title": "A"})
+        self.assertEqual(store.get("a"), {"title": "A"})
+        self.assertIsNone(store.get("b"))
+
+    def test_expired_stories_are_deleted(self):
+        store = SQLiteStoryStore(self.path, ttl=0.05, purge_every=5)
+        for index in range(4):
+            store.put(f"old{index}", {"index": index})
+        time.sleep(0.1)
+        self.assertIsNone(store.get("old0"))
+        store.put("new", {})  # The fifth put purges
+        self.assertEqual(self.rows(), 1)
+        self.assertEqual(store.get("new"), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+# wsgi.py
+"""Production entry point.
+
+    gunicorn --preload --workers 4 wsgi:app
+
+With --preload the app is imported and warmed up once, in the master
+process, and the forked workers share that memory copy-on-write instead of
+each repeating the setup. Set LOG_LEVEL=WARNING to drop the debug logging.
+
+Each worker is its own process. The default STORY_STORE=memory keeps
+stories in the worker that made them, so /story and /download-pdf lose the
+story whenever the next request lands on another worker: with more than
+one worker set STORY_STORE=sqlite:///path/to/stories.db or a redis:// URL.
+/api/jobs statuses and Idempotency-Key results stay per worker either way;
+a poll or retry reaching another worker won't find them. The workers share
+the images in IMAGE_CACHE_DIR, and its size bound.
+"""
+import gc
+
+from app1 import create_app
+
+app = create_app()
+
+# Everything made so far lives as long as the process. Keep the garbage
+# collector from visiting it in the workers, which would write to (and so
+# copy) the shared pages
+gc.freeze()